@@ -1,32 +1,41 @@
 
 import numpy as np
 import pandas as pd
+import rewards
+from dataset_cache import load_dataset
+from profiling import timed
 
 class BandwidthAllocation:
     def __init__(self, csv_path):
         # System constants
-        self.TOTAL_BANDWIDTH = 10000
+        self.TOTAL_BANDWIDTH = rewards.TOTAL_BANDWIDTH  # Capacity of the whole pool, shared by every user
         self.MIN_BANDWIDTH = 1000
-        self.NUM_USERS = 10
         
         # Reward calculation constants
-        self.MAX_CAPACITY = 1000
-        self.BETA = 3
-        self.THETA = 0.2
-        self.GAMMA = -0.5
-        self.MIN_DURATION = 3
+        self.BETA = rewards.BETA
+        self.THETA = rewards.THETA
+        self.GAMMA = rewards.GAMMA
+        self.MIN_DURATION = rewards.MIN_DURATION
         
         # Load and prepare data
-        self.rl_state = self.load_data(csv_path)
+        with timed('initallo.load'):
+            self.rl_state = self.load_data(csv_path)
         self.N = len(self.rl_state['DID'].unique())
         self.T = len(self.rl_state['step'].unique())
+        self._step_rewards = None
+
+        # Streaming abuse state for scoring live steps, one slot per known user
+        self.user_slots = {did: slot for slot, did in enumerate(sorted(self.rl_state['DID'].unique()))}
+        self.abuse_tracker = rewards.AbuseTracker(self.N, self.THETA, self.MIN_DURATION)
 
     def load_data(self, csv_path):
-        # Read the CSV file
-        df = pd.read_csv(csv_path)
+        # Open the CSV through its typed columnar cache
+        dataset = load_dataset(csv_path, codes=('user_id',), timestamps=())
+        df = dataset.to_frame()
         
-        # Convert user_id to string format like 'user_1'
-        df['DID'] = 'user_' + df['user_id'].astype(str)
+        # Convert user_id to string format like 'user_1', labelling each distinct user once
+        labels = np.array([f"user_{user_id}" for user_id in dataset.categories['user_id'].tolist()], dtype=object)
+        df['DID'] = labels[dataset['user_id']]
         
         # Ensure column names match the expected format
         if 'requested' in df.columns:
@@ -34,73 +43,95 @@ class BandwidthAllocation:
         
         return df
 
+    def pivot_steps(self, data):
+        """Reshape an allocation log into [steps, users] requested/allocated arrays.
+
+        Expects at most one row per (step, DID); users missing from a step are
+        marked in the returned ``present`` mask.
+        """
+        table = data.pivot(index='step', columns='DID', values=['BW_REQUESTED', 'allocated'])
+        requested = table['BW_REQUESTED'].to_numpy(dtype=float)
+        allocated = table['allocated'].to_numpy(dtype=float)
+        return table.index, requested, allocated, ~np.isnan(requested)
+
     def allocation_efficiency_reward(self, data):
-        total_efficiency = 0
-        for _, row in data.iterrows():
-            requested = row['BW_REQUESTED']
-            allocated = row['allocated']
-            mir = row['allocated']  # Using allocated as MIR since MIR is 0
-            
-            if requested >= mir:
-                efficiency = mir / requested
-            else:
-                efficiency = 1
-            
-            total_efficiency += efficiency
-        return total_efficiency / len(data)
+        requested = data['BW_REQUESTED'].to_numpy(dtype=float)
+        mir = data['allocated'].to_numpy(dtype=float)  # Using allocated as MIR since MIR is 0
+        return rewards.efficiency_reward(requested, mir)
 
     def over_allocation_penalty(self, data):
-        total_allocated = data['allocated'].sum()
-        over_penalty = 0
-        
-        if total_allocated > self.MAX_CAPACITY * self.NUM_USERS:
-            overage = (total_allocated - self.MAX_CAPACITY * self.NUM_USERS) / (self.MAX_CAPACITY * self.NUM_USERS)
-            over_penalty = self.BETA * overage
-        
-        return over_penalty
+        allocated = data['allocated'].to_numpy(dtype=float)
+        return rewards.over_allocation_penalty(allocated, self.TOTAL_BANDWIDTH, self.BETA)
 
     def abusive_usage_penalty(self, data):
-        abuse_penalty = 0
-        abuse_scores = {}
-        
-        for user in data['DID'].unique():
-            user_data = data[data['DID'] == user]
-            abuse_count = 0
-            abuse_score = 0
-            
-            for _, row in user_data.iterrows():
-                requested = row['BW_REQUESTED']
-                mir = row['allocated']  # Using allocated as MIR
-                
-                if requested > mir * (1 + self.THETA):
-                    abuse_count += 1
-                else:
-                    if abuse_count >= self.MIN_DURATION:
-                        abuse_score += abuse_count - self.MIN_DURATION
-                    abuse_count = 0
-            
-            if abuse_count >= self.MIN_DURATION:
-                abuse_score += abuse_count - self.MIN_DURATION
-            
-            abuse_scores[user] = abuse_score
-        
-        S_total = sum(abuse_scores.values())
-        abuse_penalty = self.GAMMA * (S_total / (self.N * self.T))
-        
-        return abuse_penalty
+        # Using allocated as MIR; runs are followed per user across the steps in data
+        _, requested, allocated, present = self.pivot_steps(data)
+        abuse_mask = rewards.abusive(requested, allocated, self.THETA) & present
+        abuse_counters = rewards.abuse_counters_over_trace(abuse_mask)
+
+        S_total = rewards.abuse_score_increments(abuse_counters, self.MIN_DURATION).sum()
+        return rewards.abusive_usage_penalty(S_total, self.N, self.T, self.GAMMA)
 
     def calculate_step_rewards(self, step_number):
-        step_data = self.rl_state[self.rl_state['step'] == step_number]
-        
-        R_efficiency = self.allocation_efficiency_reward(step_data)
-        P_over = self.over_allocation_penalty(step_data)
-        P_abusive = self.abusive_usage_penalty(step_data)
-        
+        step_rewards = self.calculate_all_step_rewards().loc[step_number]
+        return step_rewards['R_efficiency'], step_rewards['P_over'], step_rewards['P_abusive'], step_rewards['R_t']
+
+    def score_live_step(self, step_data):
+        """Score one new step of allocation decisions incrementally.
+
+        Abuse runs continue from the previous calls through ``abuse_tracker``,
+        so each call costs O(users) instead of rescanning the history. Rows for
+        users not in the loaded log are ignored.
+        """
+        with timed('initallo.live.index'):
+            slots = step_data['DID'].map(self.user_slots)
+            known = slots.notna().to_numpy()
+            slots = slots[known].to_numpy(dtype=int)
+
+            requested = np.zeros(self.N)
+            mir = np.full(self.N, np.nan)  # Users without a decision keep their last MIR
+            present = np.zeros(self.N, dtype=bool)
+            requested[slots] = step_data['BW_REQUESTED'].to_numpy(dtype=float)[known]
+            mir[slots] = step_data['allocated'].to_numpy(dtype=float)[known]  # Using allocated as MIR
+            present[slots] = True
+
+        with timed('reward.efficiency'):
+            R_efficiency = rewards.efficiency_reward(requested, mir, present)
+        with timed('reward.over_allocation'):
+            P_over = rewards.over_allocation_penalty(np.where(present, mir, 0), self.TOTAL_BANDWIDTH, self.BETA)
+        with timed('reward.abuse'):
+            score = self.abuse_tracker.update(requested, mir, present)
+            P_abusive = rewards.abusive_usage_penalty(score, self.N, self.T, self.GAMMA)
+
         # Total reward
         R_t = R_efficiency - P_over - P_abusive
-        
+
         return R_efficiency, P_over, P_abusive, R_t
 
+    def calculate_all_step_rewards(self):
+        """Score every step of the allocation log in one pass.
+
+        Returns a DataFrame indexed by step with the columns R_efficiency,
+        P_over, P_abusive and R_t. Abuse runs are followed across steps, so a
+        step's P_abusive is its share of the whole-trace penalty.
+        """
+        if self._step_rewards is None:
+            with timed('initallo.pivot'):
+                steps, requested, allocated, present = self.pivot_steps(self.rl_state)
+            R_efficiency, P_over, P_abusive, R_t = rewards.trace_rewards(
+                requested, allocated, allocated, present, num_intervals=self.T,
+                capacity=self.TOTAL_BANDWIDTH, beta=self.BETA, theta=self.THETA,
+                gamma=self.GAMMA, min_duration=self.MIN_DURATION
+            )
+            self._step_rewards = pd.DataFrame({
+                'R_efficiency': R_efficiency,
+                'P_over': P_over,
+                'P_abusive': P_abusive,
+                'R_t': R_t,
+            }, index=pd.Index(steps, name='step'))
+
+        return self._step_rewards
+
 
 def main():
     # File path
@@ -109,13 +140,15 @@ def main():
     # Create instance with CSV data
     allocator = BandwidthAllocation(csv_path)
     
-    # Get unique steps from the data
-    unique_steps = sorted(allocator.rl_state['step'].unique())
+    # Calculate rewards for every step in one pass
+    rewards = allocator.calculate_all_step_rewards()
+    by_step = allocator.rl_state.groupby('step')
+    total_requested = by_step['BW_REQUESTED'].sum()
+    total_allocated = by_step['allocated'].sum()
+    remaining_bandwidth = by_step['remaining_bandwidth'].first()
     
-    # Calculate and display rewards for each step
-    for step in unique_steps:
-        R_efficiency, P_over, P_abusive, R_t = allocator.calculate_step_rewards(step)
-        
+    # Display rewards for each step
+    for step, (R_efficiency, P_over, P_abusive, R_t) in rewards.iterrows():
         print(f"\nStep {step} Results:")
         print(f"Allocation Efficiency Reward (R_efficiency): {R_efficiency:.4f}")
         print(f"Over-allocation Penalty (P_over): {P_over:.4f}")
@@ -123,11 +156,10 @@ def main():
         print(f"Total Reward (R_t): {R_t:.4f}")
         
         # Print step statistics
-        step_data = allocator.rl_state[allocator.rl_state['step'] == step]
         print(f"\nStep {step} Statistics:")
-        print(f"Total Requested: {step_data['BW_REQUESTED'].sum()}")
-        print(f"Total Allocated: {step_data['allocated'].sum()}")
-        print(f"Remaining Bandwidth: {step_data['remaining_bandwidth'].iloc[0]}")
+        print(f"Total Requested: {total_requested[step]}")
+        print(f"Total Allocated: {total_allocated[step]}")
+        print(f"Remaining Bandwidth: {remaining_bandwidth[step]}")
         print("-" * 40)
 
 if __name__ == "__main__":
@@ -3,18 +3,112 @@ import numpy as np
 import gymnasium as gym
 from gymnasium import spaces
 import pandas as pd
+from collections import deque
+from history_recorder import HistoryRecorder
+from user_slots import UserSlots
+import profiling
+from profiling import timed
+import rewards
+
+
+def build_request_matrix(data, fill_policy='zero'):
+    """Pivot a DID/Date/BW_REQUESTED frame into a dense [T, num_users] array.
+
+    Returns the float32 request matrix, a boolean mask of the cells that hold
+    a request, the DID -> column index and the Date -> row index. Missing
+    (user, interval) cells are filled according to ``fill_policy``:
+    ``'zero'`` leaves them at 0 and unmarked, ``'ffill'`` carries the user's
+    last known request forward (cells before the first request stay at 0).
+    """
+    if fill_policy not in ('zero', 'ffill'):
+        raise ValueError(f"Unknown fill policy: {fill_policy!r}")
+
+    # Keep the first request for a (user, interval) pair, as the row lookup did
+    data = data.drop_duplicates(subset=['DID', 'Date'], keep='first')
+
+    dids = np.sort(data['DID'].unique())
+    dates = data['Date'].unique()  # Intervals keep their order in the file
+    did_index = {did: j for j, did in enumerate(dids)}
+    date_index = {date: t for t, date in enumerate(dates)}
+
+    rows = data['Date'].map(date_index).to_numpy()
+    cols = data['DID'].map(did_index).to_numpy()
+
+    requests = np.zeros((len(dates), len(dids)), dtype=np.float32)
+    present = np.zeros((len(dates), len(dids)), dtype=bool)
+    requests[rows, cols] = data['BW_REQUESTED'].to_numpy(dtype=np.float32)
+    present[rows, cols] = True
+
+    if fill_policy == 'ffill':
+        # Index of the last observed row for every cell, then gather from it
+        last_seen = np.where(present, np.arange(len(dates))[:, None], 0)
+        np.maximum.accumulate(last_seen, axis=0, out=last_seen)
+        requests = np.take_along_axis(requests, last_seen, axis=0)
+        present = np.maximum.accumulate(present, axis=0)
+
+    return requests, present, did_index, date_index
+
+
+def allocate_bandwidth(requested_bw, mir):
+    """Bandwidth given to each user for its MIR: its request up to 1000 Kbps, then up to the MIR."""
+    initial_bw = np.minimum(requested_bw, 1000)
+    return initial_bw + np.minimum(requested_bw - initial_bw, mir - initial_bw)
+
+
+def allocation_step(state, abuse_counters, action, theta, delta_t_min, gamma, num_intervals):
+    """Apply one allocation step to ``state`` in place and score it.
+
+    ``state`` is a single [num_users, 4] matrix or a [B, num_users, 4] batch;
+    ``abuse_counters`` and ``action`` match its leading axes. Returns the
+    reward(s), the remaining bandwidth after the initial allocation and the
+    updated abuse counters.
+    """
+    with timed('env.step.allocate'):
+        action = np.asarray(action, dtype=np.float64)
+        requested_bw = state[..., 1]
+
+        # Phase 1: Allocate initial bandwidth per user, capped to 1000
+        initial_bw = np.minimum(requested_bw, 1000)
+
+        # Update remaining bandwidth after initial allocation
+        remaining_bandwidth = rewards.TOTAL_BANDWIDTH - initial_bw.sum(axis=-1)
+
+        # Phase 2: Allocate additional bandwidth based on actions taken
+        state[..., 0] = action  # Update Current MIR
+        state[..., 2] = allocate_bandwidth(requested_bw, action)
+
+    # Efficiency reward, over-allocation and abuse penalties from the shared kernel
+    with timed('env.step.reward'):
+        _, _, _, total_reward, abuse_counters = rewards.step_rewards(
+            requested_bw, state[..., 0], state[..., 2], abuse_counters, num_intervals,
+            theta=theta, gamma=gamma, min_duration=delta_t_min
+        )
+    return total_reward, remaining_bandwidth, abuse_counters
+
 
 class BandwidthEnv(gym.Env):
-    """Custom Gym environment for bandwidth allocation."""
+    """Custom Gym environment for bandwidth allocation.
 
-    def __init__(self, data, theta=0.2, delta_t_min=3, gamma=0.5):
+    By default every DID of the trace has its own row in the observation. With
+    ``max_users`` the observation has that many slots instead, and DIDs are
+    placed in them as they appear and leave after ``idle_intervals``
+    intervals without a request (see ``UserSlots``), so traces whose
+    subscriber set changes fit the same spaces. Every ``step`` then observes
+    the next interval: users join, leave and reuse slots as the trace goes.
+    """
+
+    def __init__(self, data, theta=0.2, delta_t_min=3, gamma=0.5, fill_policy='zero',
+                 history_size=1000, history_path=None, max_users=None, idle_intervals=1):
         super(BandwidthEnv, self).__init__()
 
-        # Load the dataset and prepare unique intervals for time steps
-        self.data = data
-        self.unique_intervals = [self.data['Date'].unique()]
-       
-        self.num_users = data['DID'].nunique()  # Number of unique users
+        self.fill_policy = fill_policy
+
+        # One row per DID of the trace (number of unique users), or a fixed number of reusable slots
+        self.slots = None if max_users is None else UserSlots(max_users, idle_intervals)
+        self.num_users = max_users
+        self.load_trace(data)
+        if self.num_users is None:
+            self.num_users = len(self.did_index)
         self.delta_t_min = delta_t_min  # Minimum time intervals for abuse detection
         self.gamma = gamma  # Weight for penalty calculation
         self.theta = theta  # Threshold for abuse detection
@@ -29,104 +123,142 @@ class BandwidthEnv(gym.Env):
         self.abuse_counters = np.zeros(self.num_users)
         self.remaining_bandwidth = 10_000  # Total bandwidth pool in Kbps
 
-        # To store history for analysis later
-        self.observation_history = []
-        self.time_history = []
+        # To store a bounded history for analysis later, optionally spilled to disk
+        self.history = HistoryRecorder(self.num_users, capacity=history_size, spill_path=history_path)
+        self.time_history = deque(maxlen=history_size)
+
+    def load_trace(self, data):
+        """Load the dataset and index it once as a dense [T, num_users] matrix.
+
+        A prebuilt (requests, present, did_index, date_index) tuple is used
+        as-is. Called again on a built env, this replaces the trace; without
+        ``max_users`` the new trace must have the same number of users.
+        """
+        self.data = data
+        if isinstance(data, pd.DataFrame):
+            data = build_request_matrix(data, self.fill_policy)
+            missing = int(data[1].size - data[1].sum())
+            if missing:
+                print(f"{missing} (user, interval) cells have no data under fill policy '{self.fill_policy}'")
+        requests, present, did_index, date_index = data
+
+        if self.slots is None and self.num_users is not None and len(did_index) != self.num_users:
+            raise ValueError(f"Trace has {len(did_index)} users but the env was built for {self.num_users}; "
+                             "pass max_users to replay traces with different user sets")
+
+        self.requests, self.present, self.did_index, self.date_index = requests, present, did_index, date_index
+        self.unique_intervals = [np.array(list(self.date_index))]
+        self.num_intervals = len(self.unique_intervals[0])
+        self.column_dids = sorted(self.did_index, key=self.did_index.get)  # Matrix column -> DID
+        self.current_step = 0
+
+    @property
+    def active_users(self):
+        """Boolean mask of the observation rows that currently hold a user."""
+        if self.slots is None:
+            return np.ones(self.num_users, dtype=bool)
+        return self.slots.active.copy()
+
+    @property
+    def follows_trace(self):
+        """Whether ``step`` loads the requests of the next interval into the returned observation.
+
+        Always the case with ``max_users``, where the users holding the slots change between intervals.
+        """
+        return self.slots is not None
+
+    @property
+    def observation_history(self):
+        """The most recent observations, oldest first."""
+        return self.history.recent()
 
     def reset(self, seed=None, options=None):
         """Reset the environment to an initial state."""
-        super().reset(seed=seed)
+        with timed('env.reset'):
+            super().reset(seed=seed)
         
-        # Reset history and state for the first interval
-        self.state = np.zeros((self.num_users, 4))
-        self.abuse_counters = np.zeros(self.num_users)
-        self.remaining_bandwidth = 10_000
-
-        # Check and reset the current step if out of bounds
-        if self.current_step >= len(self.unique_intervals[0]):
-            print("Current step is out of bounds. Resetting to 0.")
-            self.current_step = 0
-
-        # Loop through each user to set initial states
-        for i in range(self.num_users):
-            user_data = self.data[
-                (self.data['DID'] == 235009875 + i + 1) &
-                (self.data['Date'] == self.unique_intervals[0][self.current_step])
-            ]
-
-            # Ensure data is available for the user at the current interval
-            if not user_data.empty:
-                self.state[i, 1] = user_data.iloc[0]['BW_REQUESTED']  # Requested BW
-                self.state[i, 0] = 1000  # Initial Current MIR
-                self.state[i, 2] = 0  # Initial Allocated BW
-                self.state[i, 3] = 0  # Initial Abuse Flag
-                self.time_history.append(str(user_data.iloc[0]['Date']))
-            else:
-                print(f"No data available for DID: {235009875 + i + 1} at interval {self.unique_intervals[0][self.current_step]}")
-
-        return self.state, {}
+            # Reset history and state for the first interval
+            self.state = np.zeros((self.num_users, 4))
+            self.abuse_counters = np.zeros(self.num_users)
+            self.remaining_bandwidth = 10_000
 
-    def step(self, action):
-        """Execute one time step within the environment."""
-        rewards, penalties, abuse_scores = [], [], []
-        allocated_bandwidths = []
-        
-        # Phase 1: Allocate initial bandwidth per user
-        for j in range(self.num_users):
-            requested_bw = self.state[j, 1]
-            allocated_bw = min(requested_bw, 1000)  # Cap initial allocation to 1000
-            self.state[j, 2] = allocated_bw
-            allocated_bandwidths.append(allocated_bw)
+            # An episode that ran to the end of the trace starts the next one from its first interval
+            if self.current_step >= self.num_intervals:
+                self.current_step = 0
 
-        # Update remaining bandwidth after initial allocation
-        self.remaining_bandwidth = 10_000 - sum(allocated_bandwidths)
+            # Users are placed in slots afresh every episode
+            if self.slots is not None:
+                self.slots.clear()
 
-        # Phase 2: Allocate additional bandwidth based on actions taken
-        for i in range(self.num_users):
-            mir = action[i]
-            self.state[i, 0] = mir  # Update Current MIR
-            requested_bw = self.state[i, 1]
-            additional_bw = min(requested_bw - self.state[i, 2], mir - self.state[i, 2])
-            self.state[i, 2] += additional_bw  # Update allocated bandwidth
-            allocated_bandwidths[i] += additional_bw
-
-        # Abuse detection logic
-        for i in range(self.num_users):
-            mir = self.state[i, 0]
-            requested_bw = self.state[i, 1]
-            if requested_bw > mir * (1 + self.theta):
-                self.abuse_counters[i] += 1  # Increment abuse counter
-            else:
-                self.abuse_counters[i] = 0  # Reset if no abuse
-
-            # Calculate abuse scores for penalties
-            if self.abuse_counters[i] >= self.delta_t_min:
-                abuse_scores.append(self.abuse_counters[i] - self.delta_t_min)
-
-            # Reward calculation based on efficiency
-            r = min(self.state[i, 0] / self.state[i, 1], 1)  # Efficiency reward
-            rewards.append(r)
-
-        # Efficiency reward calculation
-        efficiency_rewards = np.mean(rewards)
-
-        # Total abuse score and penalty calculation
-        S_total = sum(abuse_scores)
-        P_abusive = (self.gamma * S_total) / (self.num_users * len(self.unique_intervals))
-        total_allocated = sum(allocated_bandwidths)
-        
-        # Penalty if total allocation exceeds capacity
-        if total_allocated > 10_000:
-            penalties.append((total_allocated - 10_000) / 10_000 * 3)
+            # Set initial states for every user from the pre-indexed interval row
+            requests, present, date = self.observe_interval(self.current_step)
+            self.state[:, 1] = np.where(present, requests, 0)  # Requested BW
+            self.state[:, 0] = np.where(present, 1000, 0)  # Initial Current MIR
+            self.time_history.extend([str(date)] * int(present.sum()))
+
+            return self.state, {}
 
-        # Final reward computation
-        total_reward = efficiency_rewards - sum(penalties) - P_abusive
+    def interval_row(self, t):
+        """Return the requests, presence mask and Date of interval ``t``."""
+        return self.requests[t], self.present[t], self.unique_intervals[0][t]
+
+    def observe_interval(self, t):
+        """Return the requests, presence mask and Date of interval ``t`` as observation rows.
+
+        With ``max_users`` the trace's DIDs are mapped to their slots, and the
+        state and abuse counter of slots that change hands start from zero.
+        """
+        requests, present, date = self.interval_row(t)
+        if self.slots is None:
+            return requests, present, date
+
+        columns = np.flatnonzero(present)
+        slots, joined, left = self.slots.update([self.column_dids[j] for j in columns], t)
+        placed = slots >= 0
+
+        slot_requests = np.zeros(self.num_users, dtype=np.float32)
+        slot_present = np.zeros(self.num_users, dtype=bool)
+        slot_requests[slots[placed]] = requests[columns[placed]]
+        slot_present[slots[placed]] = True
+
+        changed = np.concatenate([joined, left])
+        self.state[changed] = 0
+        self.abuse_counters[changed] = 0
+        self.state[joined, 0] = 1000  # Newcomers start from the initial Current MIR, as after reset()
+        return slot_requests, slot_present, date
+
+    def load_next_interval(self):
+        """Observe interval ``current_step`` and load its requests into the state; returns its Date."""
+        requests, present, date = self.observe_interval(self.current_step)
+        self.state[:, 1] = np.where(present, requests, 0)  # Requested BW
+        self.time_history.extend([str(date)] * int(present.sum()))
+        return date
+
+    def step(self, action):
+        """Execute one time step within the environment."""
+        total_reward, self.remaining_bandwidth, self.abuse_counters = allocation_step(
+            self.state, self.abuse_counters, action, self.theta, self.delta_t_min,
+            self.gamma, self.num_intervals
+        )
         self.current_step += 1  # Move to the next time step
 
         # Determine if the episode is done
-        done = (self.current_step >= len(self.unique_intervals[0]))
+        done = (self.current_step >= self.num_intervals)
 
         # Store observation for analysis
-        self.observation_history.append(self.state.copy())
-        
-        return self.state, total_reward, False, done, {}
+        with timed('env.step.record'):
+            self.history.record(self.state)
+
+        info = {}
+        if self.follows_trace and not done:
+            info['Date'] = self.load_next_interval()
+
+        return self.state, total_reward, False, done, info
+
+    def profile_snapshot(self):
+        """Return and clear the phase timings recorded in this env's process."""
+        return profiling.snapshot(clear=True)
+
+    def close(self):
+        """Flush the recorded history to disk."""
+        self.history.close()
@@ -0,0 +1,296 @@
+# benchmarks.py
+"""
+Performance benchmarks for the environment, reward scoring and monitor parsing.
+
+Every benchmark runs on synthetic data, so results do not depend on the
+datasets at hand. Traces scale from a few users and intervals up to 10k users
+and 1M intervals. Grid points larger than `--max-cells` (users x intervals) are
+skipped so a run fits in memory.
+
+Measured:
+- `env_step`: `BandwidthEnv.step` calls per second
+- `env_reset`: median `BandwidthEnv.reset` latency
+- `reward_kernel`: rows/sec through `rewards.trace_rewards`
+- `reward_batch`: rows/sec through `BandwidthAllocation.calculate_all_step_rewards`
+- `reward_live`: rows/sec through `BandwidthAllocation.score_live_step`
+- `pcap_parse`: MB/sec read by `PcapTailReader` and counted by `BandwidthMonitor`
+- `tshark_fields_parse`: MB/sec of tshark field output through `process_fields_output`
+- `tshark_iostat_parse`: `process_output` reports per second
+
+Results are written as JSON. `--compare` reports the change against an
+earlier results file and flags regressions beyond `--tolerance`.
+
+Usage:
+    python benchmarks.py --output benchmark_results.json
+    python benchmarks.py --users 10 100 --intervals 100 10000 --compare benchmark_results.json
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import socket
+import struct
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import rewards
+from bandwidth_env import BandwidthEnv
+from gns3 import BandwidthMonitor
+from InitAllo import BandwidthAllocation
+from pcap_reader import PcapTailReader
+
+
+def synthetic_matrix(num_users, num_intervals, density=0.9, seed=0):
+    """Random (requests, present, did_index, date_index) trace, as ``build_request_matrix`` returns."""
+    rng = np.random.default_rng(seed)
+    present = rng.random((num_intervals, num_users), dtype=np.float32) < density
+    requests = rng.gamma(2.0, 750.0, size=(num_intervals, num_users)).astype(np.float32)
+    requests[~present] = 0
+    did_index = {235_000_000 + j: j for j in range(num_users)}
+    date_index = {t: t for t in range(num_intervals)}
+    return requests, present, did_index, date_index
+
+
+def synthetic_allocation_log(num_users, num_steps, seed=0):
+    """Random allocation log in the ``user_id, step, requested, allocated`` schema InitAllo reads."""
+    rng = np.random.default_rng(seed)
+    requested = rng.gamma(2.0, 750.0, size=num_users * num_steps).round(3)
+    return pd.DataFrame({
+        'user_id': np.tile(np.arange(1, num_users + 1), num_steps),
+        'step': np.repeat(np.arange(num_steps), num_users),
+        'requested': requested,
+        'allocated': np.minimum(requested * rng.uniform(0.5, 1.5, size=requested.size), 10_000).round(3),
+        'remaining_bandwidth': 0.0,
+    })
+
+
+def synthetic_pcap(path, size_mb, client_ips, seed=0):
+    """Write a classic pcap of Ethernet/IPv4 frames between ``client_ips`` and random peers."""
+    rng = np.random.default_rng(seed)
+    clients = [socket.inet_aton(ip) for ip in client_ips]
+    with open(path, 'wb') as file:
+        file.write(struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, 1))
+        written = 24
+        while written < size_mb * 1024 * 1024:
+            payload = int(rng.integers(0, 1400))
+            client = clients[rng.integers(len(clients))]
+            peer = rng.bytes(4)
+            src, dst = (client, peer) if rng.random() < 0.5 else (peer, client)
+            ip = bytes([0x45, 0]) + struct.pack('>H', 20 + payload) + b'\0' * 8 + src + dst
+            frame = b'\0' * 12 + b'\x08\x00' + ip + b'\0' * payload
+            file.write(struct.pack('<IIII', 0, 0, len(frame), len(frame)) + frame)
+            written += 16 + len(frame)
+
+
+class _DiscardSink:
+    """Monitor sink that drops every row, so benchmarks time parsing only."""
+
+    def write_rows(self, rows):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def best_of(fn, repeats):
+    """Shortest wall time of ``repeats`` calls to ``fn``, with the last return value."""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        value = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, value
+
+
+def result(benchmark, metric, value, unit, better, **params):
+    return {'benchmark': benchmark, **params, 'metric': metric, 'value': value, 'unit': unit, 'better': better}
+
+
+def bench_env(num_users, num_intervals, steps=2000, resets=200, seed=0):
+    env = BandwidthEnv(synthetic_matrix(num_users, num_intervals, seed=seed))
+    actions = np.random.default_rng(seed).uniform(1000, 10_000, size=(min(steps, 1000), num_users)).astype(np.float32)
+
+    env.reset()
+    start = time.perf_counter()
+    for i in range(steps):
+        _, _, _, truncated, _ = env.step(actions[i % len(actions)])
+        if truncated:
+            env.current_step = 0
+            env.reset()
+    step_seconds = time.perf_counter() - start
+
+    timings = np.empty(resets)
+    for i in range(resets):
+        env.current_step = 0
+        start = time.perf_counter()
+        env.reset()
+        timings[i] = time.perf_counter() - start
+    env.close()
+
+    params = {'num_users': num_users, 'num_intervals': num_intervals}
+    return [
+        result('env_step', 'throughput', steps / step_seconds, 'steps/s', 'higher', **params),
+        result('env_reset', 'latency', float(np.median(timings)) * 1e6, 'us', 'lower', **params),
+    ]
+
+
+def bench_rewards(num_users, num_intervals, live_steps=200, repeats=5, seed=0):
+    params = {'num_users': num_users, 'num_intervals': num_intervals}
+    rows = num_users * num_intervals
+
+    requested, present, _, _ = synthetic_matrix(num_users, num_intervals, seed=seed)
+    allocated = np.minimum(requested, 5000)
+    seconds, _ = best_of(lambda: rewards.trace_rewards(requested, allocated, allocated, present), repeats)
+    results = [result('reward_kernel', 'throughput', rows / seconds, 'rows/s', 'higher', **params)]
+    del requested, present, allocated
+
+    # InitAllo reads its log from a CSV file
+    log = synthetic_allocation_log(num_users, num_intervals, seed)
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = os.path.join(directory, 'allocation_log.csv')
+        log.to_csv(csv_path, index=False)
+        allocator = BandwidthAllocation(csv_path)
+
+    def score_batch():
+        allocator._step_rewards = None  # Score again instead of returning the cached result
+        return allocator.calculate_all_step_rewards()
+
+    seconds, _ = best_of(score_batch, repeats)
+    results.append(result('reward_batch', 'throughput', rows / seconds, 'rows/s', 'higher', **params))
+
+    steps = [step_data for _, step_data in itertools.islice(allocator.rl_state.groupby('step'), live_steps)]
+
+    def score_live():
+        # Every repeat replays the same steps from a fresh abuse state
+        allocator.abuse_tracker = rewards.AbuseTracker(allocator.N, allocator.THETA, allocator.MIN_DURATION)
+        for step_data in steps:
+            allocator.score_live_step(step_data)
+
+    seconds, _ = best_of(score_live, repeats)
+    live_rows = sum(len(step_data) for step_data in steps)
+    results.append(result('reward_live', 'throughput', live_rows / seconds, 'rows/s', 'higher', **params))
+    return results
+
+
+def bench_monitor(size_mb, repeats=3, seed=0):
+    params = {'size_mb': size_mb}
+    with tempfile.TemporaryDirectory() as directory:
+        pcap_file = os.path.join(directory, 'capture.pcap')
+        monitor = BandwidthMonitor(pcap_file, None, sink=_DiscardSink())
+        synthetic_pcap(pcap_file, size_mb, monitor.client_ips, seed)
+        file_mb = os.path.getsize(pcap_file) / (1024 * 1024)
+
+        def parse_capture():
+            frames = PcapTailReader(pcap_file, max_read=os.path.getsize(pcap_file)).read_new()
+            monitor.count_frames(frames)
+            return frames
+
+        seconds, frames = best_of(parse_capture, repeats)
+        results = [result('pcap_parse', 'throughput', file_mb / seconds, 'MB/s', 'higher', **params)]
+
+    # The same frames as tshark's field output
+    lines = [f"{src}\t{dst}\t{frame_len}\n" for src, dst, frame_len in frames]
+    text_mb = sum(len(line) for line in lines) / (1024 * 1024)
+    seconds, _ = best_of(lambda: monitor.process_fields_output(lines), repeats)
+    results.append(result('tshark_fields_parse', 'throughput', text_mb / seconds, 'MB/s', 'higher', **params))
+
+    report = (
+        "\n===================================================================\n"
+        "| IO Statistics                                                   |\n"
+        "| Interval: 0.000 secs                                            |\n"
+        "| Col 1: ip.addr==192.168.108.2                                   |\n"
+        "|-----------------------------------------------------------------|\n"
+        "|               |1                |                               |\n"
+        "| Interval      | Frames |  Bytes |                               |\n"
+        "|-----------------------------------------------------------------|\n"
+        f"| 0.000 <> End  | {len(frames):6d} | {sum(f[2] for f in frames)} |\n"
+        "===================================================================\n"
+    )
+    reports = 20_000
+
+    def parse_reports():
+        for _ in range(reports):
+            monitor.process_output(report)
+
+    seconds, _ = best_of(parse_reports, repeats)
+    results.append(result('tshark_iostat_parse', 'throughput', reports / seconds, 'reports/s', 'higher'))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Print the change of every result against ``baseline``; return the regressed entries."""
+    def key(entry):
+        return tuple(sorted((k, v) for k, v in entry.items() if k not in ('value', 'unit', 'better')))
+
+    previous = {key(entry): entry for entry in baseline['results']}
+    regressions = []
+    for entry in results:
+        before = previous.get(key(entry))
+        if before is None:
+            continue
+        change = entry['value'] / before['value'] - 1
+        worse = -change if entry['better'] == 'higher' else change
+        flag = 'REGRESSION' if worse > tolerance else ''
+        if flag:
+            regressions.append(entry)
+        params = ', '.join(f"{k}={v}" for k, v in entry.items() if k not in ('benchmark', 'metric', 'value', 'unit', 'better'))
+        print(f"{entry['benchmark']:<20} {params:<38} {before['value']:>14.1f} -> {entry['value']:>14.1f} {entry['unit']:<9} {change:+7.1%} {flag}")
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark environment, reward scoring and monitor parsing throughput.")
+    parser.add_argument('--users', type=int, nargs='+', default=[10, 100, 1000, 10_000], help="User counts to benchmark")
+    parser.add_argument('--intervals', type=int, nargs='+', default=[100, 10_000, 1_000_000],
+                        help="Interval counts to benchmark")
+    parser.add_argument('--max-cells', type=int, default=20_000_000,
+                        help="Skip trace sizes with more users x intervals than this")
+    parser.add_argument('--env-steps', type=int, default=2000, help="Timed env steps per trace size")
+    parser.add_argument('--pcap-mb', type=int, default=32, help="Size of the synthetic capture in MB")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed for the synthetic data")
+    parser.add_argument('--output', default='benchmark_results.json', help="JSON file for the results")
+    parser.add_argument('--compare', default=None, help="Earlier results file to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="Relative slowdown reported as a regression")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    results = []
+    for num_users in args.users:
+        for num_intervals in args.intervals:
+            if num_users * num_intervals > args.max_cells:
+                print(f"Skipping {num_users} users x {num_intervals} intervals (over --max-cells)")
+                continue
+            print(f"Benchmarking {num_users} users x {num_intervals} intervals")
+            results += bench_env(num_users, num_intervals, steps=args.env_steps, seed=args.seed)
+            results += bench_rewards(num_users, num_intervals, seed=args.seed)
+
+    print(f"Benchmarking monitor parsing on a {args.pcap_mb} MB capture")
+    results += bench_monitor(args.pcap_mb, seed=args.seed)
+
+    with open(args.output, 'w') as file:
+        json.dump({
+            'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'results': results,
+        }, file, indent=2)
+    print(f"Results saved to {args.output}")
+
+    if args.compare is not None:
+        with open(args.compare) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        print(f"{len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+# chunked_trace.py
+import queue
+import threading
+import numpy as np
+import pandas as pd
+from bandwidth_env import BandwidthEnv
+
+TRACE_COLUMNS = ['DID', 'Date', 'BW_REQUESTED']
+
+
+def interval_starts(dates):
+    """Return the positions where a new interval begins in a time-sorted Date column."""
+    dates = np.asarray(dates)
+    return np.flatnonzero(np.r_[True, dates[1:] != dates[:-1]])
+
+
+def scan_trace(csv_path, read_rows=1_000_000):
+    """Read the DID and Date columns of a time-sorted trace once.
+
+    Returns the DID -> column index (DIDs sorted, as ``build_request_matrix``
+    orders them) and the number of intervals.
+    """
+    dids = set()
+    num_intervals = 0
+    last_date = None
+    for block in pd.read_csv(csv_path, usecols=['DID', 'Date'], chunksize=read_rows):
+        dids.update(block['DID'].unique().tolist())
+        dates = block['Date'].to_numpy()
+        num_intervals += len(interval_starts(dates)) - (dates[0] == last_date)
+        last_date = dates[-1]
+    return {did: j for j, did in enumerate(sorted(dids))}, num_intervals
+
+
+class ChunkedTrace:
+    """A time-sorted DID/Date/BW_REQUESTED trace replayed from disk.
+
+    The CSV is read in blocks of ``read_rows`` rows and indexed into dense
+    [chunk_intervals, num_users] chunks on a background thread, which keeps
+    up to ``prefetch`` chunks ready ahead of the reader. Memory therefore stays
+    constant however long the trace is. Intervals are served in order by
+    ``interval_row``; asking for an earlier interval replays the file from the
+    start. ``did_index`` and ``num_intervals`` are found by a first pass over
+    the file unless given; rows of DIDs outside ``did_index`` are dropped.
+    """
+
+    def __init__(self, csv_path, chunk_intervals=1024, did_index=None, num_intervals=None,
+                 fill_policy='zero', read_rows=1_000_000, prefetch=2):
+        if fill_policy not in ('zero', 'ffill'):
+            raise ValueError(f"Unknown fill policy: {fill_policy!r}")
+        self.csv_path = csv_path
+        self.chunk_intervals = chunk_intervals
+        self.fill_policy = fill_policy
+        self.read_rows = read_rows
+        self.prefetch = prefetch
+
+        if did_index is None or num_intervals is None:
+            scanned_index, scanned_intervals = scan_trace(csv_path, read_rows)
+            did_index = scanned_index if did_index is None else did_index
+            num_intervals = scanned_intervals if num_intervals is None else num_intervals
+        self.did_index = did_index
+        self.num_intervals = num_intervals
+        self.num_users = len(did_index)
+
+        self._queue = None
+        self._stop = None
+        self._thread = None
+        self._chunk = None  # (dates, requests, present) of the chunk being served
+        self._chunk_start = 0  # Interval number of its first row
+
+    def interval_row(self, t):
+        """Return the requests, presence mask and Date of interval ``t``."""
+        if not 0 <= t < self.num_intervals:
+            raise IndexError(f"Interval {t} is outside the trace of {self.num_intervals} intervals")
+        if self._chunk is None or t < self._chunk_start:
+            self._restart()
+
+        while t >= self._chunk_start + len(self._chunk[0]):
+            self._chunk_start += len(self._chunk[0])
+            self._chunk = self._next_chunk()
+            if self._chunk is None:
+                raise IndexError(f"{self.csv_path} ends before interval {t}")
+
+        i = t - self._chunk_start
+        dates, requests, present = self._chunk
+        return requests[i], present[i], dates[i]
+
+    def __iter__(self):
+        """Yield ``(requests, present, date)`` for every interval in order."""
+        for t in range(self.num_intervals):
+            yield self.interval_row(t)
+
+    def _restart(self):
+        """Start reading the file again from its first interval."""
+        self.close()
+        self._queue = queue.Queue(maxsize=self.prefetch)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._produce, args=(self._queue, self._stop), daemon=True)
+        self._thread.start()
+        self._chunk_start = 0
+        self._chunk = self._next_chunk() or ([], None, None)
+
+    def _next_chunk(self):
+        item = self._queue.get()
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def _produce(self, chunks, stop):
+        """Background thread: put dense chunks on ``chunks``, then None at the end of the file."""
+        def put(item):
+            while not stop.is_set():
+                try:
+                    chunks.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        try:
+            for chunk in self._read_chunks():
+                if not put(chunk):
+                    return
+            put(None)
+        except Exception as e:
+            put(e)
+
+    def _read_chunks(self):
+        """Yield (dates, requests, present) chunks of ``chunk_intervals`` intervals."""
+        # The last request of every user, carried across chunks for the 'ffill' policy
+        carry = (np.zeros(self.num_users, dtype=np.float32), np.zeros(self.num_users, dtype=bool))
+        pending = None
+
+        for block in pd.read_csv(self.csv_path, usecols=TRACE_COLUMNS, chunksize=self.read_rows):
+            pending = block if pending is None else pd.concat([pending, block], ignore_index=True)
+            starts = interval_starts(pending['Date'].to_numpy())
+            # The last interval may continue in the next block, so only cut before it
+            while len(starts) > self.chunk_intervals:
+                end = starts[self.chunk_intervals]
+                chunk, carry = self._dense_chunk(pending.iloc[:end], carry)
+                yield chunk
+                pending = pending.iloc[end:].reset_index(drop=True)
+                starts = starts[self.chunk_intervals:] - end
+
+        while pending is not None and len(pending):
+            starts = interval_starts(pending['Date'].to_numpy())
+            end = starts[self.chunk_intervals] if len(starts) > self.chunk_intervals else len(pending)
+            chunk, carry = self._dense_chunk(pending.iloc[:end], carry)
+            yield chunk
+            pending = pending.iloc[end:].reset_index(drop=True)
+
+    def _dense_chunk(self, rows, carry):
+        """Index the rows of whole intervals into dense arrays, as ``build_request_matrix`` does."""
+        # Keep the first request for a (user, interval) pair
+        rows = rows.drop_duplicates(subset=['DID', 'Date'], keep='first')
+        dates = rows['Date'].to_numpy()
+        starts = interval_starts(dates)
+
+        interval = np.zeros(len(rows), dtype=np.int64)
+        interval[starts[1:]] = 1
+        interval = np.cumsum(interval)
+        cols = rows['DID'].map(self.did_index).to_numpy(dtype=float)
+        known = ~np.isnan(cols)
+
+        requests = np.zeros((len(starts), self.num_users), dtype=np.float32)
+        present = np.zeros((len(starts), self.num_users), dtype=bool)
+        requests[interval[known], cols[known].astype(np.int64)] = rows['BW_REQUESTED'].to_numpy(dtype=np.float32)[known]
+        present[interval[known], cols[known].astype(np.int64)] = True
+
+        if self.fill_policy == 'ffill':
+            # Continue from the previous chunk's last row, then gather from each cell's last observed row
+            requests = np.vstack([carry[0], requests])
+            present = np.vstack([carry[1], present])
+            last_seen = np.where(present, np.arange(len(present))[:, None], 0)
+            np.maximum.accumulate(last_seen, axis=0, out=last_seen)
+            requests = np.take_along_axis(requests, last_seen, axis=0)[1:]
+            present = np.maximum.accumulate(present, axis=0)[1:]
+
+        return (dates[starts], requests, present), (requests[-1], present[-1])
+
+    def close(self):
+        """Stop the background reader."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self._chunk = None
+
+
+class StreamingBandwidthEnv(BandwidthEnv):
+    """BandwidthEnv that reads its intervals from a ``ChunkedTrace`` instead of an in-memory matrix."""
+
+    def __init__(self, trace, **kwargs):
+        self.trace = trace
+        super().__init__((None, None, trace.did_index, {}), **kwargs)
+        self.num_intervals = trace.num_intervals
+
+    def interval_row(self, t):
+        return self.trace.interval_row(t)
+
+    def close(self):
+        super().close()
+        self.trace.close()
@@ -0,0 +1,171 @@
+# dataset_cache.py
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+# Bytes hashed from each end of the source file for its cache key
+FINGERPRINT_BYTES = 1024 * 1024
+
+
+def source_key(csv_path):
+    """Return a short hash identifying the contents of ``csv_path``.
+
+    Hashes the file size and modification time with its first and last MiB,
+    so large traces are keyed without reading them in full.
+    """
+    stat = os.stat(csv_path)
+    digest = hashlib.blake2b(f"{stat.st_size}:{stat.st_mtime_ns}".encode(), digest_size=8)
+    with open(csv_path, 'rb') as file:
+        digest.update(file.read(FINGERPRINT_BYTES))
+        if stat.st_size > FINGERPRINT_BYTES:
+            file.seek(max(FINGERPRINT_BYTES, stat.st_size - FINGERPRINT_BYTES))
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+class CachedDataset:
+    """Typed columns of a CSV file, memory-mapped from a ``.npy`` cache.
+
+    Code columns hold int32 indices into their sorted ``categories``,
+    timestamp columns int64 nanoseconds since the epoch, float columns
+    float32 and integer columns int64.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'meta.json')) as file:
+            self.meta = json.load(file)
+        self.kinds = self.meta['kinds']
+
+        self.columns = {name: np.load(self._path(name), mmap_mode='r') for name in self.kinds}
+        self.categories = {
+            name: np.load(self._path(name, 'categories'))
+            for name, kind in self.kinds.items() if kind == 'codes'
+        }
+
+    def _path(self, name, suffix='values'):
+        return os.path.join(self.directory, f"{name}.{suffix}.npy")
+
+    def __len__(self):
+        return self.meta['rows']
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def decoded(self, name):
+        """Return column ``name`` with codes mapped back to their values and timestamps as datetime64."""
+        kind = self.kinds[name]
+        if kind == 'codes':
+            return self.categories[name][self.columns[name]]
+        if kind == 'timestamp':
+            return self.columns[name].view('datetime64[ns]')
+        return self.columns[name]
+
+    def to_frame(self, columns=None):
+        """Return the selected columns (all by default) as a DataFrame."""
+        columns = list(self.kinds) if columns is None else columns
+        return pd.DataFrame({name: self.decoded(name) for name in columns}, copy=False)
+
+
+def _convert_chunk(chunk, codes, timestamps):
+    """Type every column of one CSV chunk, returning ``{name: (kind, array)}``."""
+    converted = {}
+    for name in chunk.columns:
+        values = chunk[name]
+        if name in timestamps:
+            converted[name] = ('timestamp', pd.to_datetime(values).to_numpy(dtype='datetime64[ns]').view(np.int64))
+        elif name in codes or not pd.api.types.is_numeric_dtype(values):
+            converted[name] = ('codes', values.to_numpy())
+        elif pd.api.types.is_integer_dtype(values):
+            converted[name] = ('int', values.to_numpy(dtype=np.int64))
+        else:
+            converted[name] = ('float', values.to_numpy(dtype=np.float32))
+    return converted
+
+
+def build_cache(csv_path, directory, codes=('DID',), timestamps=('Date',), chunk_size=1_000_000, key=None):
+    """Parse ``csv_path`` once in chunks and write its typed columns to ``directory``."""
+    kinds = {}
+    parts = {}
+    category_codes = {}  # Per code column: value -> code, in order of first appearance
+    rows = 0
+
+    for chunk in pd.read_csv(csv_path, chunksize=chunk_size):
+        for name, (kind, values) in _convert_chunk(chunk, codes, timestamps).items():
+            known = kinds.setdefault(name, kind)
+            if known != kind:
+                if {known, kind} != {'int', 'float'}:
+                    raise ValueError(f"Column {name!r} of {csv_path} changes type between chunks")
+                # Whole numbers in some chunks of a decimal column: store the column as float
+                kinds[name] = 'float'
+            if kind == 'codes':
+                # Map the chunk's distinct values to running codes, then gather per row
+                lookup = category_codes.setdefault(name, {})
+                uniques, inverse = np.unique(values, return_inverse=True)
+                chunk_codes = np.array([lookup.setdefault(value, len(lookup)) for value in uniques.tolist()],
+                                       dtype=np.int32)
+                values = chunk_codes[inverse]
+            parts.setdefault(name, []).append(values)
+        rows += len(chunk)
+
+    # Build in a temporary directory so an interrupted run never leaves a partial cache
+    staging = directory + '.tmp'
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    for name, kind in kinds.items():
+        if kind == 'float':
+            values = np.concatenate([part.astype(np.float32, copy=False) for part in parts.pop(name)])
+        else:
+            values = np.concatenate(parts.pop(name))
+        if kind == 'codes':
+            # Renumber the codes in sorted category order
+            categories = np.array(list(category_codes[name]))
+            order = np.argsort(categories, kind='stable')
+            rank = np.empty(len(order), dtype=np.int32)
+            rank[order] = np.arange(len(order), dtype=np.int32)
+            values = rank[values]
+            np.save(os.path.join(staging, f"{name}.categories.npy"), categories[order])
+        np.save(os.path.join(staging, f"{name}.values.npy"), values)
+
+    with open(os.path.join(staging, 'meta.json'), 'w') as file:
+        json.dump({'source': os.path.abspath(csv_path), 'key': key, 'rows': rows, 'kinds': kinds}, file, indent=2)
+
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(staging, directory)
+
+
+def load_dataset(csv_path, cache_dir=None, codes=('DID',), timestamps=('Date',)):
+    """Open ``csv_path`` through its columnar cache, building it on first use.
+
+    The cache lives in ``cache_dir`` (default: ``.dataset_cache`` next to the
+    CSV) under a directory keyed by the file's hash and the column schema, so
+    an edited file is parsed again and its older caches are removed. ``codes``
+    and ``timestamps`` name the columns stored as categorical codes and epoch
+    timestamps; other non-numeric columns are stored as codes as well.
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(csv_path)), '.dataset_cache')
+    stem = os.path.splitext(os.path.basename(csv_path))[0]
+    key = source_key(csv_path)
+    schema = hashlib.blake2b(repr((sorted(codes), sorted(timestamps))).encode(), digest_size=4).hexdigest()
+    directory = os.path.join(cache_dir, f"{stem}-{key}-{schema}")
+
+    if not os.path.isfile(os.path.join(directory, 'meta.json')):
+        print(f"Building columnar cache for {csv_path} in {directory}")
+        os.makedirs(cache_dir, exist_ok=True)
+        build_cache(csv_path, directory, codes, timestamps, key=key)
+
+        # Drop the caches of earlier versions of the same file
+        for entry in os.listdir(cache_dir):
+            meta_path = os.path.join(cache_dir, entry, 'meta.json')
+            if not entry.startswith(f"{stem}-") or not os.path.isfile(meta_path):
+                continue
+            with open(meta_path) as file:
+                meta = json.load(file)
+            if meta['source'] == os.path.abspath(csv_path) and meta['key'] != key:
+                shutil.rmtree(os.path.join(cache_dir, entry), ignore_errors=True)
+
+    return CachedDataset(directory)
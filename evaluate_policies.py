@@ -0,0 +1,236 @@
+# evaluate_policies.py
+"""
+Offline comparison of allocation policies over a historical trace.
+
+Every policy follows the trace: each interval is decided and scored with that
+interval's own requests, as a `BandwidthEnv` with `max_users` or a
+`LiveBandwidthEnv` steps. (The default `BandwidthEnv` that `train_agent.py`
+trains on keeps the requests loaded at reset for the whole episode.) At each
+interval the policy sets a MIR for every user, the bandwidth is allocated as
+in `BandwidthEnv` and the result is scored
+with the shared reward kernel (`rewards.trace_rewards`) the way the env scores
+a step: users without a request in an interval are scored with a request of 0,
+so they count as fully served in the efficiency reward and add nothing to the
+penalties. Abuse runs carry across the whole trace. Policies:
+
+- `static`: the same MIR (`--static-mir`) for every user
+- `proportional`: the pool split in proportion to each user's request
+- `maxmin`: max-min fair (water-filling) split of the pool
+- `ppo`: the trained model from `--model` (an SB3 model or a `.npz` export),
+  fed a [num_users, 4] observation in `BandwidthEnv`'s layout that holds
+  each interval's requests
+
+The baselines are computed for all intervals of a segment at once. The model
+depends on its previous decisions, so it steps through the intervals, deciding
+for all users in one forward pass per interval. Each policy runs in its own
+worker process, attached to the request matrix in shared memory. All MIRs
+are clipped to the env's action bounds, as SB3 does for the model. Traces are
+processed in segments of `--segment` intervals so memory stays bounded.
+
+Usage:
+    python evaluate_policies.py --data sorted.csv --model bandwidth_model --output evaluation.json
+    python evaluate_policies.py --data sorted.csv --policies static maxmin --static-mir 2000
+"""
+import argparse
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import rewards
+from bandwidth_env import allocate_bandwidth, build_request_matrix
+from dataset_cache import load_dataset
+from shared_matrix import SharedRequestMatrix
+
+BASELINES = ['static', 'proportional', 'maxmin']
+
+# BandwidthEnv's action bounds in Kbps; every policy's MIR is clipped to them
+MIN_MIR = 1000
+MAX_MIR = 10_000
+
+
+def static_mir(requested, present, capacity, mir=1000):
+    return np.full(requested.shape, float(mir))
+
+
+def proportional_share(requested, present, capacity):
+    demand = np.where(present, requested, 0)
+    total = demand.sum(axis=-1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(total > 0, capacity * demand / total, 0)
+
+
+def max_min_fair(requested, present, capacity):
+    """Water-filling: users below the fair share get their request, the rest share what is left equally."""
+    demand = np.where(present, requested, 0).astype(np.float64)
+    ordered = np.sort(demand, axis=-1)
+    num_users = ordered.shape[-1]
+
+    # Fair share left for user k onwards once every smaller request is served in full
+    served_before = np.cumsum(ordered, axis=-1) - ordered
+    level = (capacity - served_before) / (num_users - np.arange(num_users))
+    short = ordered > level
+    first_short = short.argmax(axis=-1)
+    water = np.where(short.any(axis=-1), np.take_along_axis(level, first_short[..., None], axis=-1)[..., 0], np.inf)
+    return np.minimum(demand, water[..., None])
+
+
+POLICIES = {'static': static_mir, 'proportional': proportional_share, 'maxmin': max_min_fair}
+
+
+def load_policy(model_path):
+    """Load an .npz export with NumpyPolicy, anything else as an SB3 PPO model."""
+    if model_path.endswith('.npz'):
+        from numpy_policy import NumpyPolicy
+        return NumpyPolicy.load(model_path)
+    from stable_baselines3 import PPO
+    return PPO.load(model_path, device='cpu')
+
+
+class ModelReplay:
+    """Feed a trained model BandwidthEnv-layout observations holding each interval's requests in turn.
+
+    The state follows the trace as in a trace-following env: its requested
+    column is reloaded every interval, and its MIR and allocation come from
+    the model's previous decision.
+    """
+
+    def __init__(self, model_path, num_users):
+        self.policy = load_policy(model_path)
+        # NumpyPolicy stores the shape it was exported with; SB3 models keep their observation space
+        shape = tuple(getattr(self.policy, 'observation_shape', None) or self.policy.observation_space.shape)
+        if shape != (num_users, 4):
+            raise ValueError(f"Model expects observations of shape {shape}, the trace gives ({num_users}, 4)")
+        self.state = None  # Columns: [Current MIR, BW_requested, BW_allocated, Abuse Flag]
+
+    def __call__(self, requested, present, capacity):
+        mir = np.empty(requested.shape)
+        for t in range(len(requested)):
+            requested_bw = np.where(present[t], requested[t], 0)
+            if self.state is None:
+                # First interval, as after reset(): the initial MIR for every present user
+                self.state = np.zeros((requested.shape[1], 4))
+                self.state[:, 0] = np.where(present[t], 1000, 0)
+            self.state[:, 1] = requested_bw
+
+            action, _ = self.policy.predict(self.state.astype(np.float32), deterministic=True)
+            self.state[:, 0] = action
+            self.state[:, 2] = allocate_bandwidth(requested_bw, action)
+            mir[t] = action
+        return mir
+
+
+def evaluate_policy(matrix, name, options, segment):
+    """Worker: replay the shared trace with one policy and score it."""
+    requests, present, _, _ = matrix.attach()
+    num_intervals, num_users = requests.shape
+    capacity = rewards.TOTAL_BANDWIDTH
+    if name == 'ppo':
+        policy = ModelReplay(options['model'], num_users)
+    else:
+        policy = POLICIES[name]
+    kwargs = {'mir': options['static_mir']} if name == 'static' else {}
+
+    start_time = time.perf_counter()
+    R_t = np.empty(num_intervals)
+    totals = {'R_efficiency': 0.0, 'P_over': 0.0, 'P_abusive': 0.0, 'requested': 0.0, 'allocated': 0.0,
+              'over_capacity': 0}
+    counters = None  # Abuse runs open at the end of the previous segment
+    for begin in range(0, num_intervals, segment):
+        end = min(begin + segment, num_intervals)
+        requested = np.where(present[begin:end], requests[begin:end], 0).astype(np.float64)
+        seg_present = present[begin:end]
+
+        mir = np.clip(policy(requested, seg_present, capacity, **kwargs), MIN_MIR, MAX_MIR)
+        allocated = allocate_bandwidth(requested, mir)
+
+        # Every user is scored, as in BandwidthEnv: absent users have a request of 0
+        R_efficiency, P_over, P_abusive, R_t[begin:end] = rewards.trace_rewards(
+            requested, mir, allocated, initial_counters=counters, num_intervals=num_intervals
+        )
+        counters = rewards.abuse_counters_over_trace(rewards.abusive(requested, mir), counters)[-1]
+
+        totals['R_efficiency'] += R_efficiency.sum()
+        totals['P_over'] += P_over.sum()
+        totals['P_abusive'] += P_abusive.sum()
+        totals['requested'] += requested.sum()
+        totals['allocated'] += allocated.sum()
+        totals['over_capacity'] += int((allocated.sum(axis=-1) > capacity).sum())
+
+    return {
+        'policy': name,
+        'mean_reward': float(R_t.mean()),
+        'total_reward': float(R_t.sum()),
+        'mean_R_efficiency': totals['R_efficiency'] / num_intervals,
+        'mean_P_over': totals['P_over'] / num_intervals,
+        'mean_P_abusive': totals['P_abusive'] / num_intervals,
+        'allocation_ratio': totals['allocated'] / totals['requested'] if totals['requested'] else float('nan'),
+        'over_capacity_rate': totals['over_capacity'] / num_intervals,
+        'seconds': time.perf_counter() - start_time,
+    }, R_t
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare allocation policies on a historical request trace.")
+    parser.add_argument('--data', default='sorted.csv', help="CSV dataset with DID, Date and BW_REQUESTED columns")
+    parser.add_argument('--cache-dir', default=None, help="Directory for the columnar dataset cache")
+    parser.add_argument('--policies', nargs='+', choices=BASELINES + ['ppo'], default=None,
+                        help="Policies to evaluate (default: every baseline, plus ppo when --model is given)")
+    parser.add_argument('--model', default=None, help="Model saved by train_agent.py, or an .npz from numpy_policy.py")
+    parser.add_argument('--static-mir', type=float, default=1000, help="MIR of the static policy in Kbps")
+    parser.add_argument('--segment', type=int, default=10_000, help="Intervals scored at once per policy")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: one per policy)")
+    parser.add_argument('--output', default='evaluation.json', help="JSON file for the summary")
+    parser.add_argument('--per-step', default=None, help="CSV file for every policy's reward per interval")
+    args = parser.parse_args()
+
+    if args.policies is None:
+        args.policies = BASELINES + (['ppo'] if args.model is not None else [])
+    if 'ppo' in args.policies and args.model is None:
+        parser.error("--policies ppo needs --model")
+    return args
+
+
+def main():
+    args = parse_args()
+
+    # Index the trace once and share it with the workers
+    data = load_dataset(args.data, cache_dir=args.cache_dir).to_frame(['DID', 'Date', 'BW_REQUESTED'])
+    requests, present, did_index, date_index = build_request_matrix(data)
+    matrix = SharedRequestMatrix(requests, present, did_index, date_index)
+    print(f"Evaluating {', '.join(args.policies)} on {len(date_index)} intervals x {len(did_index)} users")
+
+    options = {'model': args.model, 'static_mir': args.static_mir}
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers or len(args.policies)) as pool:
+            futures = [pool.submit(evaluate_policy, matrix, name, options, args.segment) for name in args.policies]
+            results = [future.result() for future in futures]
+    finally:
+        matrix.unlink()
+
+    summaries = [summary for summary, _ in results]
+    print(f"{'policy':<14} {'mean R_t':>10} {'R_eff':>8} {'P_over':>8} {'P_abuse':>8} {'alloc %':>8} {'over %':>8} {'secs':>7}")
+    for row in sorted(summaries, key=lambda row: -row['mean_reward']):
+        print(f"{row['policy']:<14} {row['mean_reward']:>10.4f} {row['mean_R_efficiency']:>8.4f} "
+              f"{row['mean_P_over']:>8.4f} {row['mean_P_abusive']:>8.4f} {row['allocation_ratio']:>8.1%} "
+              f"{row['over_capacity_rate']:>8.1%} {row['seconds']:>7.2f}")
+
+    with open(args.output, 'w') as file:
+        json.dump({
+            'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'data': args.data,
+            'num_intervals': len(date_index),
+            'num_users': len(did_index),
+            'results': summaries,
+        }, file, indent=2)
+    print(f"Summary saved to {args.output}")
+
+    if args.per_step is not None:
+        per_step = pd.DataFrame({summary['policy']: R_t for summary, R_t in results})
+        per_step.insert(0, 'Date', list(date_index))
+        per_step.to_csv(args.per_step, index=False)
+        print(f"Per-interval rewards saved to {args.per_step}")
+
+
+if __name__ == "__main__":
+    main()
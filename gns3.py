@@ -5,16 +5,17 @@ This script monitors bandwidth usage for specific clients on a network by analyz
 
 Key Components:
 - **PCAP File**: The script reads from a specified packet capture file (usually generated by tools like Wireshark) that contains network traffic data.
-- **CSV Output**: The bandwidth statistics for each client are recorded in a CSV file, including details such as the Date, DDI (Data Device Identifier), and calculated bandwidth.
+- **CSV Output**: The bandwidth statistics for each client are recorded in a CSV file, including details such as the Date, DID (the client's DDI, Data Device Identifier), and calculated bandwidth.
 - **Clients**: The script tracks multiple clients based on their IP addresses, and each client is mapped to a specific name and DDI value.
 
 How It Works:
 1. **Initialization**: The `BandwidthMonitor` class is initialized with the paths to the PCAP and CSV files. It sets up client mappings and initializes cumulative statistics.
-2. **Running Tshark**: The script uses the `tshark` command-line tool (part of the Wireshark suite) to analyze the PCAP file for bandwidth statistics related to each client IP.
+2. **Running Tshark**: The script uses the `tshark` command-line tool (part of the Wireshark suite) to analyze the PCAP file for bandwidth statistics related to each client IP. By default the capture is read once per tick and every frame is attributed to the tracked clients among its addresses; `single_pass=False` restores one `tshark` run per client.
 3. **Processing Output**: It processes the output from `tshark`, extracting the number of frames and bytes transmitted for each client.
-4. **Statistics Calculation**: Cumulative statistics for frames and bytes are updated, and the bandwidth is calculated in Mbps.
-5. **CSV Logging**: The results, including DDI, date, and bandwidth usage, are appended to a CSV file for record-keeping and analysis.
+4. **Statistics Calculation**: Cumulative statistics for frames and bytes are updated, and the bandwidth is calculated in Mbps. With `tail=True` the capture is read natively from the byte offset reached on the previous tick (optionally persisted to `checkpoint_file`), so only newly appended frames are parsed. Otherwise the whole file is read every tick and the previous tick's totals are subtracted, so the CSV receives per-interval deltas either way.
+5. **CSV Logging**: Each tick's results are buffered and appended in batches to a CSV file (or rotated Parquet files for a `.parquet` path) in the `DID, Date, BW_REQUESTED` schema read by `BandwidthEnv`, with one timestamp per tick and bandwidth in Kbps.
 6. **Display**: The script prints out the current statistics for each client in a formatted manner.
+7. **Scheduling**: `AsyncBandwidthMonitor` drives one or more captures (files or live interfaces) concurrently on a drift-free fixed cadence, with a timeout per tick and skipping of ticks while a slow capture is still busy.
 
 Usage:
 - **Network Analysis**: This tool can be beneficial for network administrators or researchers looking to analyze bandwidth usage patterns for specific clients within a network.
@@ -27,16 +28,38 @@ Example Workflow:
 """
 
 
+import asyncio
 import subprocess
+import tempfile
 import time
 import re
-import csv
-import os
+from pcap_reader import PcapTailReader
+from stats_sink import CsvSink, ParquetSink
+import profiling
+from profiling import timed
+
+
+def tshark_error(returncode, stderr):
+    """Message for a tshark run that exited with ``returncode``, including what it printed to stderr."""
+    message = f"tshark exited with status {returncode}"
+    stderr = stderr.strip()
+    return f"{message}: {stderr}" if stderr else message
 
 class BandwidthMonitor:
-    def __init__(self, pcap_file, csv_file):
+    def __init__(self, pcap_file, csv_file, single_pass=True, tail=False, checkpoint_file=None,
+                 interface=None, capture_duration=4, interval=5, sink=None):
         self.pcap_file = pcap_file
         self.csv_file = csv_file
+        # Seconds between ticks, used to turn each tick's bytes into a rate
+        self.interval = interval
+        # Capture live from an interface for capture_duration seconds per tick instead of reading pcap_file
+        self.interface = interface
+        self.capture_duration = capture_duration
+        # Read the capture once per tick for all clients instead of once per client
+        self.single_pass = single_pass
+        # Only read frames appended since the last tick, resuming from checkpoint_file if given
+        self.tail = tail
+        self.reader = PcapTailReader(pcap_file, checkpoint_file) if tail else None
         # Map client IPs to their respective DDI values
         self.clients = {
             '192.168.108.2': {'name': 'PC1', 'ddi': '2407561'},
@@ -44,12 +67,20 @@ class BandwidthMonitor:
         }
         # Initialize cumulative statistics for each client
         self.stats = {client_ip: {'frames': 0, 'bytes': 0} for client_ip in self.clients.keys()}
+        # Traffic seen during the last tick only
+        self.interval_stats = {client_ip: {'frames': 0, 'bytes': 0} for client_ip in self.clients.keys()}
+        # (frames, bytes) in the whole capture file at the last tick, when it is re-read every tick
+        self.capture_totals = {}
         
-        # Create CSV file and write header if it doesn't exist
-        if not os.path.isfile(self.csv_file):
-            with open(self.csv_file, mode='w', newline='') as file:
-                writer = csv.writer(file)
-                writer.writerow(['DDI', 'Date', 'Bandwidth'])  # Set header order
+        # Buffered writer for the DID, Date, BW_REQUESTED rows; Parquet for a .parquet output path
+        if sink is None:
+            sink = ParquetSink(csv_file) if csv_file.endswith('.parquet') else CsvSink(csv_file)
+        self.sink = sink
+
+    @property
+    def sample_seconds(self):
+        """Seconds of traffic a tick's counts cover: the capture window when live, else the tick interval."""
+        return self.capture_duration if self.interface is not None else self.interval
 
     @property
     def client_ips(self):
@@ -57,8 +88,16 @@ class BandwidthMonitor:
         return list(self.clients.keys())
 
     def run_tshark(self):
+        if self.tail:
+            self.run_tail()
+            return
+        if self.single_pass:
+            self.run_tshark_single_pass()
+            return
+
         try:
             # Command to run tshark for each client
+            counts = {}
             for client_ip in self.clients:
                 cmd = [
                     'tshark',
@@ -67,33 +106,143 @@ class BandwidthMonitor:
                 ]
 
                 # Run the command and capture the output
-                process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                output, _ = process.communicate()
+                with timed('monitor.tshark.spawn'):
+                    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                with timed('monitor.tshark.wait'):
+                    output, _ = process.communicate()
 
                 # Process the output
-                self.process_output(client_ip, output.decode())
+                with timed('monitor.parse'):
+                    match = self.process_output(output.decode())
+                if match:
+                    counts[client_ip] = match
+
+            self.apply_counts(counts)
+
+        except Exception as e:
+            print(f"Error running tshark: {e}")
+
+    def run_tshark_single_pass(self):
+        try:
+            # stderr goes to a file, so tshark cannot block on a full pipe while stdout is streamed
+            with tempfile.TemporaryFile(mode='w+') as errors:
+                with timed('monitor.tshark.spawn'):
+                    process = subprocess.Popen(self.fields_command(), stdout=subprocess.PIPE, stderr=errors, text=True)
+                # Lines are parsed as tshark streams them, so this includes waiting for its output
+                with timed('monitor.parse'):
+                    counts = self.process_fields_output(process.stdout)
+                with timed('monitor.tshark.wait'):
+                    process.wait()
+
+                # A failed run (missing capture, bad filter) must not be recorded as idle clients
+                if process.returncode != 0:
+                    errors.seek(0)
+                    raise RuntimeError(tshark_error(process.returncode, errors.read()))
+
+            self.apply_counts(counts)
 
         except Exception as e:
             print(f"Error running tshark: {e}")
 
-    def process_output(self, client_ip, output):
+    def fields_command(self):
+        """tshark command listing the addresses and length of every frame to or from a client."""
+        if self.interface is not None:
+            source = ['-i', self.interface, '-a', f'duration:{self.capture_duration}']
+        else:
+            source = ['-r', self.pcap_file]
+
+        return [
+            'tshark', *source,
+            '-Y', 'ip.addr in {' + ' '.join(self.clients) + '}',
+            '-T', 'fields', '-E', 'separator=/t',
+            '-e', 'ip.src', '-e', 'ip.dst', '-e', 'frame.len'
+        ]
+
+    def run_tail(self):
+        try:
+            # Parse only the frames written to the capture since the last tick
+            with timed('monitor.pcap.read'):
+                frames = self.reader.read_new()
+            with timed('monitor.parse'):
+                counts = self.count_frames(frames)
+            self.apply_counts(counts)
+
+        except Exception as e:
+            print(f"Error reading capture: {e}")
+
+    def process_fields_output(self, lines):
+        """Attribute frames and bytes to every tracked client from ``ip.src ip.dst frame.len`` lines."""
+        frames = []
+        for line in lines:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) == 3 and fields[2]:
+                frames.append((fields[0], fields[1], int(fields[2])))
+        return self.count_frames(frames)
+
+    def count_frames(self, frames):
+        """Sum frames and bytes per tracked client from ``(src, dst, frame_len)`` tuples.
+
+        A frame counts for each tracked client among its source and destination
+        addresses, as the per-client ``ip.addr==`` filter does.
+        """
+        counts = {client_ip: [0, 0] for client_ip in self.clients}
+
+        for src, dst, frame_len in frames:
+            # Tunnelled frames list several comma-separated addresses per field
+            for address in set(src.split(',') + dst.split(',')):
+                if address in counts:
+                    counts[address][0] += 1
+                    counts[address][1] += frame_len
+
+        return counts
+
+    def apply_counts(self, counts):
+        """Record one tick of per-client (frames, bytes) counts and write its rows.
+
+        Without ``tail`` a capture file is read whole on every tick, so its
+        counts are totals and the tick's traffic is what they grew by.
+        """
+        if self.interface is None and not self.tail:
+            counts = self.capture_deltas(counts)
+
+        for client_ip, (frames, bytes_) in counts.items():
+            self.update_statistics(client_ip, frames, bytes_)
+
+        # Write the tick's rows with a single timestamp shared by all clients
+        with timed('monitor.write'):
+            self.write_statistics(list(counts))
+
+    def capture_deltas(self, totals):
+        """Turn whole-capture (frames, bytes) totals into the traffic added since the previous tick."""
+        deltas = {}
+        for client_ip, (frames, bytes_) in totals.items():
+            last_frames, last_bytes = self.capture_totals.get(client_ip, (0, 0))
+            if frames < last_frames or bytes_ < last_bytes:
+                # The capture was truncated or replaced: count it from its start again
+                last_frames, last_bytes = 0, 0
+            deltas[client_ip] = (frames - last_frames, bytes_ - last_bytes)
+            self.capture_totals[client_ip] = (frames, bytes_)
+        return deltas
+
+    def process_output(self, output):
         # Regex to capture the frames and bytes statistics
         match = re.search(r'\| *(\d+) *\| *(\d+) *\|', output)
 
         if match:
             frames = int(match.group(1))
             bytes_ = int(match.group(2))
+            return frames, bytes_
+        return None
 
-            # Update cumulative statistics
-            if client_ip in self.stats:
-                self.stats[client_ip]['frames'] += frames
-                self.stats[client_ip]['bytes'] += bytes_
+    def update_statistics(self, client_ip, frames, bytes_):
+        # Update cumulative statistics
+        if client_ip in self.stats:
+            self.stats[client_ip]['frames'] += frames
+            self.stats[client_ip]['bytes'] += bytes_
+            self.interval_stats[client_ip] = {'frames': frames, 'bytes': bytes_}
 
-            # Write cumulative statistics to CSV
-            self.write_statistics_to_csv(client_ip)
-
-            # Display the updated statistics in an organized way
-            self.display_statistics(client_ip)
+        # Display the updated statistics in an organized way
+        self.display_statistics(client_ip)
 
     def display_statistics(self, client_ip):
         client_info = self.clients[client_ip]
@@ -107,29 +256,157 @@ class BandwidthMonitor:
         print(f"Bytes: {bytes_:,} bytes")
         print(f"BW_REQUESTED: {bandwidth_mbps:.2f} Mbps")
 
-    def write_statistics_to_csv(self, client_ip):
+    def write_statistics(self, client_ips):
+        """Send one ``DID, Date, BW_REQUESTED`` row per client for the current tick to the sink.
+
+        BW_REQUESTED is the traffic added to the capture during the tick in
+        Kbps, averaged over the seconds it covers (``sample_seconds``), the
+        unit ``BandwidthEnv`` expects.
+        """
         Date = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
-        client_info = self.clients[client_ip]
-        DDI = client_info['ddi']
-        total_bytes = self.stats[client_ip]['bytes']
-        BW_REQUESTED = (total_bytes * 8) / (1024 * 1024)  # Convert bytes to Mbps
+        rows = []
+        for client_ip in client_ips:
+            DID = self.clients[client_ip]['ddi']
+            BW_REQUESTED = (self.interval_stats[client_ip]['bytes'] * 8) / 1000 / self.sample_seconds  # Convert bytes to Kbps
+            rows.append((DID, Date, round(BW_REQUESTED, 3)))
+        self.sink.write_rows(rows)
+
+    def close(self):
+        """Flush buffered rows and close the output file."""
+        self.sink.close()
+
+class AsyncBandwidthMonitor:
+    """Drive several BandwidthMonitor captures concurrently on a fixed cadence.
+
+    Every capture gets its own scheduler task. Ticks are due at
+    ``start + k * interval`` on the event loop's monotonic clock, so the time
+    spent processing a tick does not delay the next one. Each tick spawns tshark
+    with ``asyncio.create_subprocess_exec`` (or reads a tailed capture in a
+    thread) and is cancelled after ``timeout`` seconds; a tailed read cannot be
+    interrupted, so it stays in flight and its frames are recorded late
+    instead of being dropped. A capture keeps at most
+    one tick in flight: when its previous tick is still running, the due tick
+    is skipped and counted in ``skipped_ticks`` instead of queueing up, so a
+    slow capture never holds up the others. ``max_concurrent`` bounds the number
+    of tshark processes running at once.
+    """
+
+    def __init__(self, monitors, interval=5, timeout=None, max_concurrent=None):
+        self.monitors = monitors
+        self.interval = interval
+        for monitor in monitors:
+            monitor.interval = interval
+        self.timeout = timeout if timeout is not None else interval
+        self.max_concurrent = max_concurrent or len(monitors)
+        self.skipped_ticks = [0] * len(monitors)
+        self.timed_out_ticks = [0] * len(monitors)
+
+    async def run(self, duration=None):
+        """Monitor every capture until ``duration`` seconds have passed (forever if None)."""
+        loop = asyncio.get_running_loop()
+        self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        start = loop.time()
+        end = None if duration is None else start + duration
+
+        await asyncio.gather(*(self._schedule(index, start, end) for index in range(len(self.monitors))))
+
+    async def _schedule(self, index, start, end):
+        loop = asyncio.get_running_loop()
+        in_flight = None
+        tick = 0
+
+        while True:
+            due = start + tick * self.interval
+            if end is not None and due >= end:
+                break
+            await asyncio.sleep(max(0, due - loop.time()))
+
+            if in_flight is not None and not in_flight.done():
+                # Backpressure: the previous tick is still running
+                self.skipped_ticks[index] += 1
+            else:
+                in_flight = asyncio.create_task(self._tick(index))
+            tick += 1
+
+            # If the loop fell behind by whole intervals, drop those ticks rather than bursting
+            missed = int((loop.time() - (start + tick * self.interval)) // self.interval)
+            if missed > 0:
+                self.skipped_ticks[index] += missed
+                tick += missed
+
+        if in_flight is not None:
+            await in_flight
+
+    async def _tick(self, index):
+        monitor = self.monitors[index]
+        async with self._semaphore:
+            collect = asyncio.ensure_future(self._collect(monitor))
+            try:
+                try:
+                    # A tailed read runs in a thread, which cancelling cannot stop, so it is shielded
+                    counts = await asyncio.wait_for(asyncio.shield(collect) if monitor.tail else collect, self.timeout)
+                except asyncio.TimeoutError:
+                    self.timed_out_ticks[index] += 1
+                    print(f"Capture {monitor.interface or monitor.pcap_file} timed out after {self.timeout}s")
+                    if not monitor.tail:
+                        return
+                    # The read has already moved the reader's offset: keep the tick in flight, so no
+                    # second read starts on the same reader, and record its frames once it finishes
+                    counts = await collect
+                monitor.apply_counts(counts)
+            except Exception as e:
+                print(f"Error running tshark: {e}")
+
+    async def _collect(self, monitor):
+        if monitor.tail:
+            def read_tail():
+                with timed('monitor.pcap.read'):
+                    frames = monitor.reader.read_new()
+                with timed('monitor.parse'):
+                    return monitor.count_frames(frames)
+            return await asyncio.to_thread(read_tail)
+
+        # Wall-clock phases: other captures' tasks may run during the awaits
+        with timed('monitor.tshark.spawn'):
+            process = await asyncio.create_subprocess_exec(
+                *monitor.fields_command(), stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+            )
+        try:
+            with timed('monitor.tshark.wait'):
+                output, errors = await process.communicate()
+        except asyncio.CancelledError:
+            # Timed out: do not leave tshark running
+            process.kill()
+            await process.wait()
+            raise
+
+        # A failed capture must be reported by _tick, not recorded as idle clients
+        if process.returncode != 0:
+            raise RuntimeError(tshark_error(process.returncode, errors.decode(errors='replace')))
+
+        with timed('monitor.parse'):
+            return monitor.process_fields_output(output.decode().splitlines())
 
-        with open(self.csv_file, mode='a', newline='') as file:
-            writer = csv.writer(file)
-            writer.writerow([DDI, Date, f"{BW_REQUESTED:.2f}"])  # Write in the desired order
 
 def main():
     pcap_file = r"C:\Users\asus\OneDrive\Bureau\DevFest2024\Devfest2024_backend\udp.pcapng"  # Replace with your actual file path
     csv_file = r"C:\Users\asus\OneDrive\Bureau\DevFest_RL\bandwidth_usage.csv"  # Replace with your desired CSV file path
     monitor = BandwidthMonitor(pcap_file, csv_file)
 
-    start_time = time.time()
     duration = 60  # Duration in seconds
 
-    # Run the bandwidth monitor for a limited time
-    while time.time() - start_time < duration:
-        monitor.run_tshark()
-        time.sleep(5)  # Adjust the interval to 5 seconds
+    # With BANDWIDTH_PROFILE set, print the phase timings every minute and at the end
+    if profiling.enabled():
+        stop_dump = profiling.start_periodic_dump(interval=60)
+
+    # Run the bandwidth monitor for a limited time on a fixed 5-second cadence
+    try:
+        asyncio.run(AsyncBandwidthMonitor([monitor], interval=5).run(duration=duration))
+    finally:
+        monitor.close()
+        if profiling.enabled():
+            stop_dump.set()
+            profiling.dump()
 
 if __name__ == "__main__":
     main()
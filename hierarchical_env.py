@@ -0,0 +1,182 @@
+# hierarchical_env.py
+import numpy as np
+import pandas as pd
+from gymnasium import spaces
+from bandwidth_env import allocate_bandwidth, build_request_matrix
+from vec_env import InProcessVecEnv
+from history_recorder import HistoryRecorder
+import rewards
+from profiling import timed
+
+MAX_MIR = 10_000  # Upper bound of a user's MIR in Kbps, used to scale the features
+
+# Per-user features seen by the shared policy
+USER_FEATURES = ['Requested', 'Current_MIR', 'Allocated', 'Abuse_Run', 'Cell_Budget_Per_User', 'Cell_Demand_Ratio']
+
+
+def cell_members(cell_index):
+    """Return a [num_cells, max_cell_users] array of each cell's user columns, padded with -1."""
+    order = np.argsort(cell_index, kind='stable')
+    _, starts, counts = np.unique(cell_index[order], return_index=True, return_counts=True)
+    members = np.full((len(counts), counts.max()), -1, dtype=np.int64)
+    rank = np.arange(len(order)) - np.repeat(starts, counts)
+    members[np.repeat(np.arange(len(counts)), counts), rank] = order
+    return members
+
+
+class HierarchicalBandwidthEnv(InProcessVecEnv):
+    """Two-level allocation for large user counts with one policy shared by every user.
+
+    Users are grouped into cells, by default ``cell_size`` consecutive users
+    of the request matrix (``cells`` assigns them explicitly). The top level
+    gives every cell its users' initial allocation and splits the pool's
+    remaining bandwidth among cells in proportion to their unmet demand. Below
+    it, every user is one sub-environment of this VecEnv: it observes the
+    ``USER_FEATURES`` of itself and its cell, and the shared policy picks its
+    MIR. One forward pass over the [num_users, features] batch allocates for
+    all subscribers, so the policy's size does not depend on the user count.
+
+    Each cell is scored with the shared reward kernel against its budget, and
+    its users receive the cell's reward. Every step replays the next
+    interval of the trace.
+    """
+
+    def __init__(self, data, cell_size=10, cells=None, cell_capacity=rewards.TOTAL_BANDWIDTH,
+                 theta=0.2, delta_t_min=3, gamma=0.5, fill_policy='zero', history_size=1000, history_path=None):
+        if isinstance(data, pd.DataFrame):
+            data = build_request_matrix(data, fill_policy)
+        self.requests, self.present, self.did_index, self.date_index = data
+        self.num_intervals = len(self.date_index)
+        self.num_users = len(self.did_index)  # Number of unique users
+
+        self.delta_t_min = delta_t_min  # Minimum time intervals for abuse detection
+        self.gamma = gamma  # Weight for penalty calculation
+        self.theta = theta  # Threshold for abuse detection
+
+        # Cell of every user column, renumbered 0..num_cells-1
+        if cells is None:
+            cells = np.arange(self.num_users) // cell_size
+        _, self.cell_index = np.unique(np.asarray(cells), return_inverse=True)
+        self.members = cell_members(self.cell_index)
+        self.member_mask = self.members >= 0
+        self.num_cells = len(self.members)
+        self.cell_users = self.member_mask.sum(axis=1)
+        self.capacity = cell_capacity * self.num_cells  # Pool shared by all cells
+
+        observation_space = spaces.Box(low=0, high=10, shape=(len(USER_FEATURES),), dtype=np.float32)
+        action_space = spaces.Box(low=1000, high=MAX_MIR, shape=(1,), dtype=np.float32)
+        super().__init__(self.num_users, observation_space, action_space)
+
+        self.current_step = 0
+        self.state = np.zeros((self.num_users, 4))  # Columns: [Current MIR, BW_requested, BW_allocated, Abuse Flag]
+        self.abuse_counters = np.zeros(self.num_users)
+        self.cell_budget = np.zeros(self.num_cells)
+        self.cell_demand = np.zeros(self.num_cells)
+        self.remaining_bandwidth = float(self.capacity)
+
+        # To store a bounded history of the [num_users, 4] state for analysis later
+        self.history = HistoryRecorder(self.num_users, capacity=history_size, spill_path=history_path)
+
+    @property
+    def observation_history(self):
+        """The most recent observations, oldest first."""
+        return self.history.recent()
+
+    def cell_sum(self, values):
+        """Sum a per-user array within every cell."""
+        return np.bincount(self.cell_index, weights=values, minlength=self.num_cells)
+
+    def by_cell(self, values):
+        """Gather a per-user array into the padded [num_cells, max_cell_users] layout."""
+        return np.where(self.member_mask, values[self.members], 0)
+
+    def _load_interval(self, t):
+        """Read the requests of interval ``t`` and split the pool among cells."""
+        with timed('env.split'):
+            self._split_pool(t)
+
+    def _split_pool(self, t):
+        requested = np.where(self.present[t], self.requests[t], 0)
+        self.state[:, 1] = requested
+
+        # Top level: every cell keeps its initial allocation and shares the rest by unmet demand
+        initial_bw = np.minimum(requested, 1000)
+        self.remaining_bandwidth = self.capacity - initial_bw.sum()
+        self.cell_demand = self.cell_sum(requested - initial_bw)
+        total_demand = self.cell_demand.sum()
+        if total_demand > 0:
+            share = self.cell_demand / total_demand
+        else:
+            share = self.cell_users / self.num_users
+        self.cell_budget = self.cell_sum(initial_bw) + max(self.remaining_bandwidth, 0) * share
+
+    def observations(self):
+        """Return the [num_users, features] batch for the shared policy."""
+        budget = self.cell_budget[self.cell_index]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            demand_ratio = np.where(budget > 0, self.cell_demand[self.cell_index] / budget, 0)
+        features = np.column_stack([
+            self.state[:, 1] / MAX_MIR,
+            self.state[:, 0] / MAX_MIR,
+            self.state[:, 2] / MAX_MIR,
+            np.minimum(self.abuse_counters / (self.delta_t_min + 1), 1),
+            budget / (self.cell_users[self.cell_index] * MAX_MIR),
+            demand_ratio,
+        ])
+        return np.clip(features, 0, 10).astype(np.float32)
+
+    def reset(self):
+        """Restart the trace for every user and return the batched observation."""
+        self._reset_seeds()
+        self.current_step = 0
+        self.state[:] = 0
+        self.abuse_counters[:] = 0
+        self._load_interval(self.current_step)
+        return self.observations()
+
+    def step_wait(self):
+        """Allocate for every user in one vectorized call and score each cell."""
+        with timed('env.step.allocate'):
+            action = np.asarray(self._actions, dtype=np.float64).reshape(self.num_users)
+            requested_bw = self.state[:, 1]
+
+            # Lower level: the shared policy's MIR per user, allocated as in BandwidthEnv
+            self.state[:, 0] = action  # Update Current MIR
+            self.state[:, 2] = allocate_bandwidth(requested_bw, action)
+
+        # Score every cell against its budget with the shared kernel
+        with timed('env.step.reward'):
+            self.abuse_counters = rewards.update_abuse_counters(self.abuse_counters, requested_bw, action, self.theta)
+            R_efficiency = rewards.efficiency_reward(
+                self.by_cell(requested_bw), self.by_cell(self.state[:, 0]), self.member_mask
+            )
+            with np.errstate(divide='ignore', invalid='ignore'):
+                P_over = rewards.over_allocation_penalty(self.by_cell(self.state[:, 2]), self.cell_budget, rewards.BETA)
+            P_abusive = rewards.abusive_usage_penalty(
+                self.cell_sum(self.abuse_counters > self.delta_t_min), self.cell_users, self.num_intervals, self.gamma
+            )
+            cell_reward = R_efficiency - P_over - P_abusive
+
+        with timed('env.step.record'):
+            self.history.record(self.state)
+        self.current_step += 1
+
+        # All users share one episode over the trace; it ends on the time limit
+        infos = [{} for _ in range(self.num_users)]
+        if self.current_step >= self.num_intervals:
+            terminal = self.observations()
+            for i, info in enumerate(infos):
+                info['terminal_observation'] = terminal[i]
+                info['TimeLimit.truncated'] = True
+            obs = self.reset()
+            dones = np.ones(self.num_users, dtype=bool)
+        else:
+            self._load_interval(self.current_step)
+            obs = self.observations()
+            dones = np.zeros(self.num_users, dtype=bool)
+
+        return obs, cell_reward[self.cell_index].astype(np.float32), dones, infos
+
+    def close(self):
+        """Flush the recorded history to disk."""
+        self.history.close()
@@ -0,0 +1,135 @@
+# history_recorder.py
+import os
+import numpy as np
+import pandas as pd
+
+# Column names of the [num_users, 4] observation matrix
+OBSERVATION_COLUMNS = ['Current_MIR', 'Requested_Bandwidth', 'Allocated_Bandwidth', 'Abuse_Flag']
+
+
+class HistoryRecorder:
+    """Bounded observation history with an optional on-disk spill.
+
+    The most recent ``capacity`` observations are kept in a ring buffer. When
+    ``spill_path`` is given, every observation is also streamed to disk: to a
+    memory-mapped ``.npy`` file of shape [steps, num_users, 4] that is
+    preallocated for ``spill_steps`` steps and doubled when full, or, for a
+    ``.parquet`` path, appended in chunks of ``chunk_size`` steps.
+    """
+
+    def __init__(self, num_users, capacity=1000, spill_path=None, spill_steps=10_000, chunk_size=1000):
+        self.num_users = num_users
+        self.capacity = capacity
+        self.spill_path = spill_path
+        self.chunk_size = chunk_size
+
+        self.buffer = np.zeros((capacity, num_users, 4), dtype=np.float32)
+        self.num_steps = 0  # Total observations recorded, including those evicted
+
+        self._memmap = None
+        self._parquet_writer = None
+        self._chunk = []
+        self._chunk_start = 0  # Step number of the first observation in the pending chunk
+        if spill_path is not None and not spill_path.endswith('.parquet'):
+            self._memmap = np.lib.format.open_memmap(
+                spill_path, mode='w+', dtype=np.float32, shape=(spill_steps, num_users, 4)
+            )
+
+    def __len__(self):
+        return self.num_steps
+
+    def record(self, observation):
+        """Store one [num_users, 4] observation."""
+        self.buffer[self.num_steps % self.capacity] = observation
+
+        if self._memmap is not None:
+            if self.num_steps == len(self._memmap):
+                self._resize_spill_file(2 * len(self._memmap))
+                self._memmap = np.load(self.spill_path, mmap_mode='r+')
+            self._memmap[self.num_steps] = observation
+        elif self.spill_path is not None:
+            self._chunk.append(np.asarray(observation, dtype=np.float32))
+            if len(self._chunk) >= self.chunk_size:
+                self._write_chunk()
+
+        self.num_steps += 1
+
+    def recent(self):
+        """Return the buffered observations, oldest first."""
+        if self.num_steps <= self.capacity:
+            return self.buffer[:self.num_steps].copy()
+        start = self.num_steps % self.capacity
+        return np.concatenate([self.buffer[start:], self.buffer[:start]])
+
+    def _resize_spill_file(self, steps):
+        """Grow or shrink the ``.npy`` spill file in place to ``steps`` rows."""
+        self._memmap.flush()
+        offset = self._memmap.offset
+        self._memmap = None
+
+        # The header reserves room for the first axis to grow, so its size does not change
+        with open(self.spill_path, 'r+b') as file:
+            np.lib.format.write_array_header_1_0(file, {
+                'descr': np.lib.format.dtype_to_descr(np.dtype(np.float32)),
+                'fortran_order': False,
+                'shape': (steps, self.num_users, 4),
+            })
+            if file.tell() != offset:
+                raise RuntimeError(f"Cannot resize {self.spill_path}: header size changed")
+            file.truncate(offset + steps * self.num_users * 4 * np.dtype(np.float32).itemsize)
+
+    def _write_chunk(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        chunk = np.stack(self._chunk).reshape(-1, 4)
+        first_step = self._chunk_start
+        columns = {
+            'step': np.repeat(np.arange(first_step, first_step + len(self._chunk)), self.num_users),
+            'user': np.tile(np.arange(self.num_users), len(self._chunk)),
+        }
+        columns.update({name: chunk[:, k] for k, name in enumerate(OBSERVATION_COLUMNS)})
+        table = pa.table(columns)
+
+        if self._parquet_writer is None:
+            self._parquet_writer = pq.ParquetWriter(self.spill_path, table.schema)
+        self._parquet_writer.write_table(table)
+        self._chunk_start += len(self._chunk)
+        self._chunk = []
+
+    def close(self):
+        """Flush the spill file and trim it to the number of recorded steps."""
+        if self._memmap is not None:
+            self._resize_spill_file(self.num_steps)
+        elif self.spill_path is not None:
+            if self._chunk:
+                self._write_chunk()
+            if self._parquet_writer is not None:
+                self._parquet_writer.close()
+                self._parquet_writer = None
+
+
+def history_frame(observations):
+    """Flatten a [steps, num_users, 4] array into one DataFrame row per (step, user)."""
+    steps, num_users, _ = observations.shape
+    flat = observations.reshape(-1, 4)
+
+    columns = {
+        'step': np.repeat(np.arange(steps), num_users),
+        'user': np.tile(np.arange(num_users), steps),
+    }
+    columns.update({name: flat[:, k] for k, name in enumerate(OBSERVATION_COLUMNS)})
+    return pd.DataFrame(columns)
+
+
+def load_history(path):
+    """Load a spilled history as a DataFrame with one row per (step, user)."""
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    return history_frame(np.load(path, mmap_mode='r'))
+
+
+def spill_path_for(path, rank):
+    """Per-worker spill file name, e.g. ``history.npy`` -> ``history.2.npy``."""
+    root, ext = os.path.splitext(path)
+    return f"{root}.{rank}{ext}"
@@ -0,0 +1,174 @@
+"""
+Live bridge from BandwidthMonitor to BandwidthEnv.
+
+`LiveRequestSource` turns each monitor tick into one observation row: a
+[num_users] array of requested bandwidth (Kbps) ordered by a fixed list of
+DIDs. It implements the monitor sink interface (`write_rows`, `flush`,
+`close`), so a monitor in the same process feeds it directly with
+`BandwidthMonitor(..., sink=source)`. A monitor in another process uses
+`SocketSink` instead, which sends each tick as one JSON line to a source
+listening on a local TCP port or Unix socket (`LiveRequestSource.listen`).
+
+Rows wait in a bounded queue. When the consumer falls behind, the oldest
+rows are dropped so the policy always acts on fresh traffic.
+
+`LiveBandwidthEnv` is a `BandwidthEnv` whose intervals come from the source:
+`reset()` waits for the next tick, and every `step()` loads the following tick
+as the requests of the returned observation.
+"""
+
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+import numpy as np
+from bandwidth_env import BandwidthEnv
+
+
+class TickTCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class TickUnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+class LiveRequestSource:
+    def __init__(self, dids, maxsize=64, fill_policy='zero'):
+        if fill_policy not in ('zero', 'ffill'):
+            raise ValueError(f"Unknown fill policy: {fill_policy!r}")
+
+        self.did_index = {int(did): j for j, did in enumerate(dids)}
+        self.fill_policy = fill_policy
+        self.queue = queue.Queue(maxsize)
+        self.dropped_ticks = 0  # Ticks discarded because the consumer fell behind
+        self.unknown_dids = set()
+
+        self._last_requests = np.zeros(len(self.did_index), dtype=np.float32)
+        self._last_present = np.zeros(len(self.did_index), dtype=bool)
+        self._server = None
+
+    @property
+    def num_users(self):
+        return len(self.did_index)
+
+    def write_rows(self, rows):
+        """Queue one tick of ``(DID, Date, BW_REQUESTED)`` rows as an observation row."""
+        if not rows:
+            return
+
+        if self.fill_policy == 'ffill':
+            requests, present = self._last_requests.copy(), self._last_present.copy()
+        else:
+            requests = np.zeros(self.num_users, dtype=np.float32)
+            present = np.zeros(self.num_users, dtype=bool)
+
+        for did, _, bw_requested in rows:
+            column = self.did_index.get(int(did))
+            if column is None:
+                self.unknown_dids.add(int(did))
+                continue
+            requests[column] = bw_requested
+            present[column] = True
+
+        self._last_requests, self._last_present = requests, present
+        tick = (rows[0][1], requests, present)
+
+        # Keep the freshest ticks: drop the oldest one when the queue is full
+        while True:
+            try:
+                self.queue.put_nowait(tick)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped_ticks += 1
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        """Return the next ``(Date, requests, present)`` tick; raises ``queue.Empty`` on timeout."""
+        return self.queue.get(timeout=timeout)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def listen(self, address):
+        """Accept ticks from ``SocketSink`` clients on a background thread.
+
+        ``address`` is a ``(host, port)`` tuple for TCP or a path for a Unix socket.
+        """
+        source = self
+
+        class TickHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    source.write_rows([tuple(row) for row in json.loads(line)])
+
+        if isinstance(address, tuple):
+            server_class = TickTCPServer
+        else:
+            server_class = TickUnixServer
+            if os.path.exists(address):
+                os.unlink(address)
+
+        self._server = server_class(address, TickHandler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self._server.server_address
+
+
+class SocketSink:
+    """Monitor sink that sends each tick as a JSON line to a listening ``LiveRequestSource``."""
+
+    def __init__(self, address):
+        if isinstance(address, tuple):
+            self.socket = socket.create_connection(address)
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        else:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.connect(address)
+
+    def write_rows(self, rows):
+        self.socket.sendall((json.dumps([[str(did), date, bw] for did, date, bw in rows]) + '\n').encode())
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.socket.close()
+
+
+class LiveBandwidthEnv(BandwidthEnv):
+    """BandwidthEnv driven by live ticks from a ``LiveRequestSource``.
+
+    An episode lasts ``episode_length`` ticks, which also normalizes the abuse
+    penalty as the number of intervals does for a recorded trace. ``timeout``
+    bounds the wait for a tick (None waits indefinitely).
+    """
+
+    def __init__(self, source, episode_length=288, timeout=None, **kwargs):
+        self.source = source
+        self.timeout = timeout
+
+        # No recorded trace: the interval axis only sets the episode length
+        requests = np.zeros((episode_length, source.num_users), dtype=np.float32)
+        present = np.zeros((episode_length, source.num_users), dtype=bool)
+        date_index = {t: t for t in range(episode_length)}
+        super().__init__((requests, present, source.did_index, date_index), **kwargs)
+
+    # Every step() allocates for the current tick, then observes the requests of the next one
+    follows_trace = True
+
+    def interval_row(self, t):
+        """Wait for the next live tick instead of reading interval ``t``."""
+        date, requests, present = self.source.get(self.timeout)
+        return requests, present, date
@@ -0,0 +1,187 @@
+# numpy_policy.py
+"""
+Dependency-free inference for trained bandwidth allocation policies.
+
+`export_policy` writes the actor of a PPO MlpPolicy trained by `train_agent.py`
+to a compact `.npz` weights file: the policy network layers, the action head,
+the log standard deviation and the action bounds. `NumpyPolicy` loads that
+file and evaluates the forward pass with NumPy only, so allocation hosts do not
+need torch or stable-baselines3. Its `predict` mirrors the SB3 call and gives
+the same actions for a [num_users, 4] observation or a batch of them.
+
+Usage:
+    python numpy_policy.py export --model bandwidth_model --output bandwidth_policy.npz
+    python numpy_policy.py benchmark --model bandwidth_model --weights bandwidth_policy.npz
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+
+ACTIVATIONS = {
+    'tanh': np.tanh,
+    'relu': lambda x: np.maximum(x, 0),
+    'identity': lambda x: x,
+}
+
+
+def export_policy(model, path):
+    """Save the actor of an SB3 PPO MlpPolicy to ``path`` as an .npz weights file."""
+    import torch.nn as nn
+
+    policy = model.policy
+    if policy.squash_output:
+        raise ValueError("Policies with squashed outputs are not supported")
+
+    weights = {}
+    activation = 'identity'
+    layers = [module for module in policy.mlp_extractor.policy_net] + [policy.action_net]
+    num_linear = 0
+    for module in layers:
+        if isinstance(module, nn.Linear):
+            # Stored transposed so the forward pass is x @ W + b
+            weights[f'W{num_linear}'] = module.weight.detach().cpu().numpy().T.astype(np.float32)
+            weights[f'b{num_linear}'] = module.bias.detach().cpu().numpy().astype(np.float32)
+            num_linear += 1
+        elif isinstance(module, nn.Tanh):
+            activation = 'tanh'
+        elif isinstance(module, nn.ReLU):
+            activation = 'relu'
+        else:
+            raise ValueError(f"Unsupported layer in the policy network: {module}")
+
+    np.savez(
+        path,
+        activation=np.array(activation),
+        num_layers=np.array(num_linear),
+        log_std=policy.log_std.detach().cpu().numpy().astype(np.float32),
+        action_low=model.action_space.low,
+        action_high=model.action_space.high,
+        observation_shape=np.array(model.observation_space.shape),
+        **weights,
+    )
+
+
+class NumpyPolicy:
+    def __init__(self, weights, biases, activation, log_std, action_low, action_high, observation_shape):
+        self.weights = weights
+        self.biases = biases
+        self.activation = ACTIVATIONS[activation]
+        self.log_std = log_std
+        self.action_low = action_low
+        self.action_high = action_high
+        self.observation_shape = tuple(observation_shape)
+        self.np_random = np.random.default_rng()
+
+    @classmethod
+    def load(cls, path):
+        """Load a policy written by ``export_policy``."""
+        with np.load(path) as file:
+            num_layers = int(file['num_layers'])
+            return cls(
+                [file[f'W{i}'] for i in range(num_layers)],
+                [file[f'b{i}'] for i in range(num_layers)],
+                str(file['activation']),
+                file['log_std'],
+                file['action_low'],
+                file['action_high'],
+                file['observation_shape'],
+            )
+
+    def predict(self, observation, state=None, episode_start=None, deterministic=True):
+        """Return ``(actions, None)`` for one observation or a batch, as SB3's ``predict`` does."""
+        observation = np.asarray(observation, dtype=np.float32)
+        vectorized = observation.shape != self.observation_shape
+        x = observation.reshape(-1, int(np.prod(self.observation_shape)))
+
+        # Hidden layers, then the linear action head giving the Gaussian mean
+        for W, b in zip(self.weights[:-1], self.biases[:-1]):
+            x = self.activation(x @ W + b)
+        actions = x @ self.weights[-1] + self.biases[-1]
+        if not deterministic:
+            actions = actions + np.exp(self.log_std) * self.np_random.standard_normal(actions.shape, dtype=np.float32)
+
+        actions = np.clip(actions, self.action_low, self.action_high)
+        return (actions if vectorized else actions[0]), None
+
+
+def startup_time(code):
+    """Seconds for a fresh interpreter to import and load a policy, as reported by ``code``."""
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def decision_latency(policy, observation, repeats):
+    """Median seconds per single-observation ``predict`` call."""
+    timings = np.empty(repeats)
+    for i in range(repeats):
+        start = time.perf_counter()
+        policy.predict(observation, deterministic=True)
+        timings[i] = time.perf_counter() - start
+    return float(np.median(timings))
+
+
+def benchmark(model_path, weights_path, repeats=1000, batch_size=256):
+    """Compare startup time, decision latency and actions of SB3 and the NumPy policy."""
+    from stable_baselines3 import PPO
+
+    # The timed interpreters run next to this module
+    model_path, weights_path = os.path.abspath(model_path), os.path.abspath(weights_path)
+    sb3_startup = startup_time(
+        "import time; start = time.perf_counter()\n"
+        "from stable_baselines3 import PPO\n"
+        f"PPO.load({model_path!r}, device='cpu')\n"
+        "print(time.perf_counter() - start)"
+    )
+    numpy_startup = startup_time(
+        "import time; start = time.perf_counter()\n"
+        "from numpy_policy import NumpyPolicy\n"
+        f"NumpyPolicy.load({weights_path!r})\n"
+        "print(time.perf_counter() - start)"
+    )
+
+    model = PPO.load(model_path, device='cpu')
+    policy = NumpyPolicy.load(weights_path)
+    rng = np.random.default_rng(0)
+    batch = rng.uniform(0, 10_000, size=(batch_size, *policy.observation_shape)).astype(np.float32)
+
+    sb3_actions, _ = model.predict(batch, deterministic=True)
+    numpy_actions, _ = policy.predict(batch, deterministic=True)
+
+    print(f"Startup:           SB3 {sb3_startup * 1000:8.1f} ms   NumPy {numpy_startup * 1000:8.1f} ms")
+    print(f"Decision latency:  SB3 {decision_latency(model, batch[0], repeats) * 1e6:8.1f} us   "
+          f"NumPy {decision_latency(policy, batch[0], repeats) * 1e6:8.1f} us")
+    print(f"Max action difference over {batch_size} observations: {np.abs(sb3_actions - numpy_actions).max():.6f} Kbps")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export a trained PPO policy to NumPy and benchmark it.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help="Write the policy weights to an .npz file")
+    export_parser.add_argument('--model', default='bandwidth_model', help="Model saved by train_agent.py")
+    export_parser.add_argument('--output', default='bandwidth_policy.npz', help="Weights file to write")
+
+    benchmark_parser = subparsers.add_parser('benchmark', help="Compare the NumPy policy with SB3 predict")
+    benchmark_parser.add_argument('--model', default='bandwidth_model', help="Model saved by train_agent.py")
+    benchmark_parser.add_argument('--weights', default='bandwidth_policy.npz', help="Exported weights file")
+    benchmark_parser.add_argument('--repeats', type=int, default=1000, help="Timed predict calls per policy")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.command == 'export':
+        from stable_baselines3 import PPO
+
+        export_policy(PPO.load(args.model, device='cpu'), args.output)
+        print(f"Policy weights saved to {args.output}")
+    else:
+        benchmark(args.model, args.weights, args.repeats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""
+PcapTailReader
+
+Incremental reader for pcap and pcapng captures that are still being written.
+
+The reader remembers the byte offset just past the last complete record it
+has parsed, so each call to `read_new()` only touches frames appended since
+the previous call, like `tail -f` on a growing capture. A record that is only
+partially written is left for the next call. The position (and the link-layer
+details needed to resume parsing) can be saved to and restored from a JSON
+checkpoint file, so a restarted monitor does not count old traffic twice.
+
+Each frame is reported as `(source IPv4, destination IPv4, frame length)`,
+with the original on-the-wire length, as tshark's `frame.len`. Frames that do
+not carry IPv4 are reported with empty addresses.
+"""
+
+import json
+import os
+import socket
+import struct
+
+# Classic pcap magic numbers (microsecond and nanosecond timestamps)
+PCAP_MAGICS = {
+    b'\xd4\xc3\xb2\xa1': '<', b'\xa1\xb2\xc3\xd4': '>',
+    b'\x4d\x3c\xb2\xa1': '<', b'\xa1\xb2\x3c\x4d': '>',
+}
+PCAPNG_SHB = b'\x0a\x0d\x0d\x0a'
+
+# pcapng block types
+BLOCK_IDB = 1  # Interface description
+BLOCK_PB = 2  # Packet (obsolete)
+BLOCK_SPB = 3  # Simple packet
+BLOCK_EPB = 6  # Enhanced packet
+
+# Link types
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_LINUX_SLL2 = 276
+
+
+def ipv4_addresses(linktype, data):
+    """Return the (source, destination) IPv4 addresses of a frame, or ('', '')."""
+    if linktype == LINKTYPE_ETHERNET:
+        offset, ethertype = 14, data[12:14]
+        while ethertype in (b'\x81\x00', b'\x88\xa8') and len(data) >= offset + 4:
+            # Skip VLAN tags
+            ethertype = data[offset + 2:offset + 4]
+            offset += 4
+        if ethertype != b'\x08\x00':
+            return '', ''
+    elif linktype == LINKTYPE_LINUX_SLL:
+        if data[14:16] != b'\x08\x00':
+            return '', ''
+        offset = 16
+    elif linktype == LINKTYPE_LINUX_SLL2:
+        if data[0:2] != b'\x08\x00':
+            return '', ''
+        offset = 20
+    elif linktype == LINKTYPE_NULL:
+        offset = 4
+    elif linktype in (LINKTYPE_RAW, LINKTYPE_IPV4):
+        offset = 0
+    else:
+        return '', ''
+
+    if len(data) < offset + 20 or data[offset] >> 4 != 4:
+        return '', ''
+    return socket.inet_ntoa(data[offset + 12:offset + 16]), socket.inet_ntoa(data[offset + 16:offset + 20])
+
+
+class PcapTailReader:
+    def __init__(self, pcap_file, checkpoint_file=None, max_read=64 * 1024 * 1024):
+        self.pcap_file = pcap_file
+        self.checkpoint_file = checkpoint_file
+        self.max_read = max_read  # Bytes read per call; the rest waits for the next one
+
+        # Parsing position and the format details needed to resume from it
+        self.offset = 0
+        self.frame_number = 0
+        self.format = None  # 'pcap' or 'pcapng', detected from the file header
+        self.byte_order = '<'
+        self.linktypes = []  # One per interface (a single entry for classic pcap)
+        self.snaplens = []
+
+        if checkpoint_file is not None and os.path.isfile(checkpoint_file):
+            self.restore()
+
+    def checkpoint(self):
+        """Save the current position to the checkpoint file."""
+        with open(self.checkpoint_file, 'w') as file:
+            json.dump({
+                'offset': self.offset,
+                'frame_number': self.frame_number,
+                'format': self.format,
+                'byte_order': self.byte_order,
+                'linktypes': self.linktypes,
+                'snaplens': self.snaplens,
+            }, file)
+
+    def restore(self):
+        """Resume from the position saved in the checkpoint file."""
+        with open(self.checkpoint_file) as file:
+            state = json.load(file)
+        self.offset = state['offset']
+        self.frame_number = state['frame_number']
+        self.format = state['format']
+        self.byte_order = state['byte_order']
+        self.linktypes = state['linktypes']
+        self.snaplens = state['snaplens']
+
+    def read_new(self):
+        """Return the (src, dst, frame_len) tuples of the frames appended since the last call."""
+        if not os.path.isfile(self.pcap_file):
+            return []
+
+        # A capture that shrank was restarted; read it again from the beginning
+        if os.path.getsize(self.pcap_file) < self.offset:
+            self.offset = 0
+            self.frame_number = 0
+            self.format = None
+
+        with open(self.pcap_file, 'rb') as file:
+            file.seek(self.offset)
+            buffer = file.read(self.max_read)
+
+        frames = []
+        position = 0
+        if self.format is None:
+            position = self._read_file_header(buffer)
+            if self.format is None:
+                return frames
+
+        if self.format == 'pcap':
+            position = self._read_pcap_records(buffer, position, frames)
+        else:
+            position = self._read_pcapng_blocks(buffer, position, frames)
+
+        self.offset += position
+        self.frame_number += len(frames)
+        if self.checkpoint_file is not None:
+            self.checkpoint()
+        return frames
+
+    def _read_file_header(self, buffer):
+        """Detect the format; return the bytes consumed (0 if the header is incomplete)."""
+        magic = buffer[:4]
+        if magic in PCAP_MAGICS:
+            if len(buffer) < 24:
+                return 0
+            self.format = 'pcap'
+            self.byte_order = PCAP_MAGICS[magic]
+            snaplen, linktype = struct.unpack(self.byte_order + 'II', buffer[16:24])
+            self.linktypes = [linktype & 0xFFFF]
+            self.snaplens = [snaplen]
+            return 24
+        if magic == PCAPNG_SHB:
+            # Blocks, including the section header, are parsed with the rest
+            self.format = 'pcapng'
+            return 0
+        if len(buffer) >= 4:
+            raise ValueError(f"{self.pcap_file} is not a pcap or pcapng capture")
+        return 0
+
+    def _read_pcap_records(self, buffer, position, frames):
+        order = self.byte_order
+        linktype = self.linktypes[0]
+        while position + 16 <= len(buffer):
+            incl_len, orig_len = struct.unpack_from(order + 'II', buffer, position + 8)
+            end = position + 16 + incl_len
+            if end > len(buffer):
+                break  # Record still being written
+            src, dst = ipv4_addresses(linktype, buffer[position + 16:end])
+            frames.append((src, dst, orig_len))
+            position = end
+        return position
+
+    def _read_pcapng_blocks(self, buffer, position, frames):
+        while position + 12 <= len(buffer):
+            order = self.byte_order
+            is_section_header = buffer[position:position + 4] == PCAPNG_SHB
+            if is_section_header:
+                # A new section sets its own byte order
+                order = '<' if buffer[position + 8:position + 12] == b'\x4d\x3c\x2b\x1a' else '>'
+
+            block_type, block_len = struct.unpack_from(order + 'II', buffer, position)
+            if block_len < 12 or position + block_len > len(buffer):
+                break  # Block still being written
+            body = buffer[position + 8:position + block_len - 4]
+
+            if is_section_header:
+                self.byte_order = order
+                self.linktypes, self.snaplens = [], []
+            elif block_type == BLOCK_IDB:
+                linktype, _, snaplen = struct.unpack_from(order + 'HHI', body)
+                self.linktypes.append(linktype)
+                self.snaplens.append(snaplen)
+            elif block_type == BLOCK_EPB:
+                interface, _, _, cap_len, orig_len = struct.unpack_from(order + 'IIIII', body)
+                src, dst = ipv4_addresses(self.linktypes[interface], body[20:20 + cap_len])
+                frames.append((src, dst, orig_len))
+            elif block_type == BLOCK_SPB:
+                orig_len, = struct.unpack_from(order + 'I', body)
+                cap_len = min(orig_len, self.snaplens[0] or orig_len)
+                src, dst = ipv4_addresses(self.linktypes[0], body[4:4 + cap_len])
+                frames.append((src, dst, orig_len))
+            elif block_type == BLOCK_PB:
+                interface, _, _, _, cap_len, orig_len = struct.unpack_from(order + 'HHIIII', body)
+                src, dst = ipv4_addresses(self.linktypes[interface], body[20:20 + cap_len])
+                frames.append((src, dst, orig_len))
+
+            position += block_len
+        return position
@@ -0,0 +1,237 @@
+# policy_server.py
+"""
+Batched inference server for trained bandwidth allocation models.
+
+The model saved by `train_agent.py` is loaded once. Allocation requests are
+accepted over local HTTP, either on a TCP port or on a Unix socket. Requests
+that arrive together, typically from many cells, are micro-batched: the
+batching thread waits at most `--max-wait-ms` after the first request for up
+to `--max-batch` observations, then runs them through a single forward pass.
+
+Endpoints:
+- `POST /allocate` with `{"observation": [[...], ...]}` (one [num_users, 4]
+  observation) returns `{"action": [...]}`; `{"observations": [...]}` returns
+  `{"actions": [...]}` for several cells at once.
+- `GET /stats` returns request and batch counts and p50/p99 latency in ms.
+
+Usage:
+    python policy_server.py --model bandwidth_model --port 8000
+    python policy_server.py --model bandwidth_model --unix /tmp/bandwidth_policy.sock
+    python policy_server.py --model bandwidth_policy.npz --port 8000
+"""
+import argparse
+import json
+import os
+import queue
+import socketserver
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+# Pending connections the listening socket queues, so bursts from many cells are not refused
+LISTEN_BACKLOG = 1024
+
+
+class _Request:
+    __slots__ = ('observation', 'action', 'error', 'start', 'done')
+
+    def __init__(self, observation):
+        self.observation = observation
+        self.action = None
+        self.error = None
+        self.start = time.perf_counter()
+        self.done = threading.Event()
+
+
+class BatchedPolicy:
+    """Collects concurrent ``predict`` calls into batches for one forward pass each."""
+
+    def __init__(self, model, max_batch=256, max_wait=0.002, latency_window=10_000):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        # SB3 models carry an observation space, a NumpyPolicy only the shape
+        if hasattr(model, 'observation_space'):
+            self.observation_shape = tuple(model.observation_space.shape)
+        else:
+            self.observation_shape = model.observation_shape
+
+        self.queue = queue.Queue()
+        self.latencies = deque(maxlen=latency_window)  # Seconds, most recent requests
+        self.num_requests = 0
+        self.num_batches = 0
+
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def predict(self, observations):
+        """Return the deterministic actions for a [n, num_users, 4] array of observations."""
+        observations = np.asarray(observations, dtype=np.float32)
+        if observations.shape[1:] != self.observation_shape:
+            raise ValueError(f"Expected observations of shape {self.observation_shape}, got {observations.shape[1:]}")
+
+        requests = [_Request(observation) for observation in observations]
+        for request in requests:
+            self.queue.put(request)
+        for request in requests:
+            request.done.wait()
+            if request.error is not None:
+                raise request.error
+        return np.stack([request.action for request in requests])
+
+    def _serve(self):
+        while True:
+            request = self.queue.get()
+            if request is None:
+                return
+
+            # Gather whatever else arrives within max_wait of the first request
+            batch = [request]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                try:
+                    request = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if request is None:
+                    self.queue.put(None)  # Stop after this batch
+                    break
+                batch.append(request)
+
+            try:
+                actions, _ = self.model.predict(np.stack([r.observation for r in batch]), deterministic=True)
+            except Exception as e:
+                for r in batch:
+                    r.error = e
+                    r.done.set()
+                continue
+
+            finished = time.perf_counter()
+            for r, action in zip(batch, actions):
+                r.action = action
+                self.latencies.append(finished - r.start)
+                r.done.set()
+            self.num_requests += len(batch)
+            self.num_batches += 1
+
+    def stats(self):
+        """Request and batch counts with latency percentiles over the recent window."""
+        latencies = np.array(self.latencies) * 1000
+        return {
+            'requests': self.num_requests,
+            'batches': self.num_batches,
+            'mean_batch_size': self.num_requests / self.num_batches if self.num_batches else 0.0,
+            'p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else None,
+            'p99_ms': float(np.percentile(latencies, 99)) if len(latencies) else None,
+        }
+
+    def close(self):
+        self.queue.put(None)
+        self._thread.join()
+
+
+class PolicyRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, so clients can reuse connections
+
+    def do_POST(self):
+        if self.path != '/allocate':
+            self._send(404, {'error': f"Unknown path {self.path}"})
+            return
+
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            if 'observations' in body:
+                actions = self.server.policy.predict(body['observations'])
+                self._send(200, {'actions': actions.tolist()})
+            else:
+                actions = self.server.policy.predict([body['observation']])
+                self._send(200, {'action': actions[0].tolist()})
+        except (KeyError, TypeError, ValueError) as e:
+            self._send(400, {'error': str(e)})
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._send(200, self.server.policy.stats())
+        else:
+            self._send(404, {'error': f"Unknown path {self.path}"})
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Per-request logging would dominate the latency
+
+
+class PolicyHTTPServer(ThreadingHTTPServer):
+    request_queue_size = LISTEN_BACKLOG
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = LISTEN_BACKLOG
+
+
+def make_server(policy, port=8000, host='127.0.0.1', unix_socket=None):
+    """HTTP server answering allocation requests with ``policy`` on a TCP port or Unix socket."""
+    if unix_socket is not None:
+        if os.path.exists(unix_socket):
+            os.unlink(unix_socket)
+        server = UnixHTTPServer(unix_socket, PolicyRequestHandler)
+    else:
+        server = PolicyHTTPServer((host, port), PolicyRequestHandler)
+    server.policy = policy
+    return server
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve a trained bandwidth allocation model over local HTTP.")
+    parser.add_argument('--model', default='bandwidth_model',
+                        help="Model saved by train_agent.py, or an .npz file from numpy_policy.py")
+    parser.add_argument('--host', default='127.0.0.1', help="Address to listen on")
+    parser.add_argument('--port', type=int, default=8000, help="TCP port to listen on")
+    parser.add_argument('--unix', default=None, help="Listen on this Unix socket instead of a TCP port")
+    parser.add_argument('--max-batch', type=int, default=256, help="Largest batch per forward pass")
+    parser.add_argument('--max-wait-ms', type=float, default=2.0, help="How long a batch waits for more requests")
+    parser.add_argument('--stats-interval', type=float, default=60.0, help="Seconds between latency reports")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.model.endswith('.npz'):
+        # Weights exported by numpy_policy.py: no torch needed
+        from numpy_policy import NumpyPolicy
+        model = NumpyPolicy.load(args.model)
+    else:
+        from stable_baselines3 import PPO
+        model = PPO.load(args.model, device='cpu')
+    policy = BatchedPolicy(model, max_batch=args.max_batch, max_wait=args.max_wait_ms / 1000)
+    server = make_server(policy, args.port, args.host, args.unix)
+    print(f"Serving {args.model} on {args.unix or f'http://{args.host}:{args.port}'}")
+
+    def report():
+        while True:
+            time.sleep(args.stats_interval)
+            print(json.dumps(policy.stats()))
+
+    threading.Thread(target=report, daemon=True).start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        policy.close()
+        print(json.dumps(policy.stats()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+# profiling.py
+"""
+Hot-path instrumentation for the environment, reward kernel and monitor.
+
+Code marks a phase with ``with timed('env.step.reward'):``. While
+instrumentation is disabled (the default), ``timed`` returns a shared no-op
+context, so a marked phase costs one function call. Once enabled, every phase
+collects a histogram of its durations in power-of-two microsecond buckets,
+summarized by ``summary()`` as counts, totals and p50/p90/p99 estimates.
+
+Instrumentation is enabled with ``enable()`` or by setting the
+``BANDWIDTH_PROFILE`` environment variable, which ``enable()`` also sets so
+that worker processes started afterwards record their own phases.
+``start_periodic_dump`` writes the summary at a fixed interval, and
+``profiled`` runs a block under cProfile. Phases are plain function scopes, so
+py-spy stacks show them without any extra setup.
+"""
+import contextlib
+import cProfile
+import json
+import math
+import os
+import threading
+import time
+
+ENV_VAR = 'BANDWIDTH_PROFILE'
+NUM_BUCKETS = 32  # Bucket k holds durations below 2**k microseconds; the last one everything above
+
+_enabled = bool(os.environ.get(ENV_VAR))
+_histograms = {}
+_lock = threading.Lock()
+_null_timer = contextlib.nullcontext()
+
+
+class Histogram:
+    """Durations of one phase in power-of-two microsecond buckets."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.buckets = [0] * NUM_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def add(self, seconds):
+        bucket = min(math.frexp(seconds * 1e6)[1], NUM_BUCKETS - 1) if seconds > 0 else 0
+        with self.lock:
+            self.buckets[bucket] += 1
+            self.count += 1
+            self.total += seconds
+            self.min = min(self.min, seconds)
+            self.max = max(self.max, seconds)
+
+    def merge(self, other):
+        """Add the counts of another histogram's ``state()``."""
+        with self.lock:
+            self.buckets = [a + b for a, b in zip(self.buckets, other['buckets'])]
+            self.count += other['count']
+            self.total += other['total']
+            self.min = min(self.min, other['min'])
+            self.max = max(self.max, other['max'])
+
+    def state(self):
+        return {'buckets': list(self.buckets), 'count': self.count, 'total': self.total,
+                'min': self.min, 'max': self.max}
+
+    def quantile(self, q):
+        """Upper bound in seconds of the bucket holding quantile ``q``, capped at the maximum."""
+        rank = q * self.count
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return min(2.0 ** bucket / 1e6, self.max)
+        return self.max
+
+    def summary(self):
+        if not self.count:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'total_s': self.total,
+            'mean_ms': self.total / self.count * 1e3,
+            'min_ms': self.min * 1e3,
+            'p50_ms': self.quantile(0.5) * 1e3,
+            'p90_ms': self.quantile(0.9) * 1e3,
+            'p99_ms': self.quantile(0.99) * 1e3,
+            'max_ms': self.max * 1e3,
+        }
+
+
+class _Timer:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.add(time.perf_counter() - self.start)
+        return False
+
+
+def histogram(phase):
+    """Return the histogram of ``phase``, creating it on first use."""
+    found = _histograms.get(phase)
+    if found is None:
+        with _lock:
+            found = _histograms.setdefault(phase, Histogram())
+    return found
+
+
+def timed(phase):
+    """Context manager recording the duration of ``phase`` while instrumentation is enabled."""
+    if not _enabled:
+        return _null_timer
+    return _Timer(histogram(phase))
+
+
+def enabled():
+    return _enabled
+
+
+def enable():
+    """Start recording phases in this process and in worker processes started afterwards."""
+    global _enabled
+    _enabled = True
+    os.environ[ENV_VAR] = '1'
+
+
+def disable():
+    global _enabled
+    _enabled = False
+    os.environ.pop(ENV_VAR, None)
+
+
+def reset():
+    """Forget every recorded duration."""
+    with _lock:
+        for found in _histograms.values():
+            found.clear()
+
+
+def snapshot(clear=False):
+    """Return the raw histogram state of every phase, optionally clearing it."""
+    with _lock:
+        state = {phase: found.state() for phase, found in _histograms.items() if found.count}
+        if clear:
+            for found in _histograms.values():
+                found.clear()
+    return state
+
+
+def merge(snapshots):
+    """Combine ``snapshot()`` results, such as those of several worker processes, into histograms."""
+    merged = {}
+    for state in snapshots:
+        for phase, phase_state in state.items():
+            merged.setdefault(phase, Histogram()).merge(phase_state)
+    return merged
+
+
+def summary(histograms=None):
+    """Return ``{phase: statistics}`` for the given histograms (default: this process's)."""
+    histograms = _histograms if histograms is None else histograms
+    return {phase: found.summary() for phase, found in sorted(histograms.items()) if found.count}
+
+
+def format_summary(stats=None):
+    """Return a summary as a text table, slowest total first."""
+    stats = summary() if stats is None else stats
+    lines = [f"{'phase':<28} {'count':>9} {'total s':>9} {'mean ms':>9} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}"]
+    for phase, row in sorted(stats.items(), key=lambda item: -item[1]['total_s']):
+        lines.append(f"{phase:<28} {row['count']:>9} {row['total_s']:>9.3f} {row['mean_ms']:>9.3f} "
+                     f"{row['p50_ms']:>9.3f} {row['p99_ms']:>9.3f} {row['max_ms']:>9.3f}")
+    return '\n'.join(lines)
+
+
+def dump(path=None, histograms=None):
+    """Write the summary as JSON to ``path``, or print it as a table."""
+    stats = summary(histograms)
+    if path is None:
+        print(format_summary(stats))
+        return
+    with open(path, 'w') as file:
+        json.dump({'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'), 'phases': stats}, file, indent=2)
+
+
+def start_periodic_dump(interval=60, path=None):
+    """Dump the summary every ``interval`` seconds from a daemon thread; returns an Event that stops it."""
+    stop = threading.Event()
+
+    def _run():
+        while not stop.wait(interval):
+            dump(path)
+
+    threading.Thread(target=_run, name='profile-dump', daemon=True).start()
+    return stop
+
+
+@contextlib.contextmanager
+def profiled(path):
+    """Run the block under cProfile and save its stats to ``path`` (readable by pstats or snakeviz)."""
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        print(f"cProfile stats saved to {path}")
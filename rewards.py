@@ -0,0 +1,204 @@
+# rewards.py
+"""
+Shared reward and penalty kernel for bandwidth allocation.
+
+Every reward in the project is computed here, so training (``BandwidthEnv``),
+offline scoring (``InitAllo``) and the ``reward&penality.py`` example agree:
+
+    R_t = R_efficiency - P_over - P_abusive
+
+- **R_efficiency**: mean over users of ``min(MIR / requested, 1)``.
+- **P_over**: ``BETA * (total_allocated - capacity) / capacity`` when the total
+  allocation exceeds the capacity of the bandwidth pool, else 0.
+- **P_abusive**: a user is abusive at a step when ``requested > MIR * (1 + THETA)``.
+  Each run of consecutive abusive steps scores ``max(length - MIN_DURATION, 0)``,
+  and the trace penalty is ``GAMMA * S_total / (N * T)``. Per step, the score
+  grows by one for every user whose run is longer than ``MIN_DURATION``, so the
+  per-step penalties of a trace add up to its trace penalty.
+
+All functions take arrays whose last axis is the user axis and reduce over it,
+so the same code scores one step ``[num_users]``, a batch of environments
+``[B, num_users]`` or a whole trace ``[T, num_users]``.
+"""
+import numpy as np
+from profiling import timed
+
+# System constants
+TOTAL_BANDWIDTH = 10_000  # Capacity of the shared bandwidth pool in Kbps
+
+# Reward calculation constants
+BETA = 3  # Penalty coefficient for over-allocation
+THETA = 0.2  # Threshold for abusive usage
+GAMMA = 0.5  # Penalty coefficient for sustained abusive usage
+MIN_DURATION = 3  # Minimum duration for abuse to count
+
+
+def efficiency_reward(requested, mir, present=None):
+    """Mean of ``min(MIR / requested, 1)`` over the users that are present."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        efficiency = np.minimum(mir / requested, 1)
+        if present is None:
+            return efficiency.mean(axis=-1)
+        return np.where(present, efficiency, 0).sum(axis=-1) / present.sum(axis=-1)
+
+
+def over_allocation_penalty(allocated, capacity=TOTAL_BANDWIDTH, beta=BETA):
+    """Penalty for the total allocation going over ``capacity``."""
+    total_allocated = allocated.sum(axis=-1)
+    return np.where(total_allocated > capacity, beta * (total_allocated - capacity) / capacity, 0)
+
+
+def abusive(requested, mir, theta=THETA):
+    """Mask of users requesting more than their MIR plus the tolerance."""
+    return requested > mir * (1 + theta)
+
+
+def update_abuse_counters(counters, requested, mir, theta=THETA):
+    """Advance per-user run lengths by one step: extend abusive runs, reset the others."""
+    return np.where(abusive(requested, mir, theta), counters + 1, 0)
+
+
+def abuse_counters_over_trace(abuse_mask, initial_counters=None):
+    """Run length of every cell of a [T, num_users] abuse mask, in one pass.
+
+    The counter of an abusive cell is its distance to the user's last
+    non-abusive step, found with a running maximum over the time axis.
+    ``initial_counters`` continues runs that were open before the trace.
+    """
+    steps = np.arange(len(abuse_mask))[:, None]
+    if initial_counters is None:
+        initial_counters = np.zeros(abuse_mask.shape[1:])
+    last_reset = np.where(abuse_mask, -1 - initial_counters, steps)
+    np.maximum.accumulate(last_reset, axis=0, out=last_reset)
+    return steps - last_reset
+
+
+def abuse_score_increments(counters, min_duration=MIN_DURATION):
+    """Abuse score gained at a step: users whose run is longer than ``min_duration``."""
+    return (counters > min_duration).sum(axis=-1)
+
+
+def abusive_usage_penalty(score, num_users, num_intervals, gamma=GAMMA):
+    """Normalized penalty for an abuse score over ``num_users`` x ``num_intervals``."""
+    return gamma * score / (num_users * num_intervals)
+
+
+def step_rewards(requested, mir, allocated, abuse_counters, num_intervals,
+                 capacity=TOTAL_BANDWIDTH, beta=BETA, theta=THETA, gamma=GAMMA, min_duration=MIN_DURATION):
+    """Incremental mode: score one step and advance the abuse counters.
+
+    Inputs are [..., num_users]. Returns ``(R_efficiency, P_over, P_abusive,
+    R_t, abuse_counters)`` with the user axis reduced.
+    """
+    with timed('reward.efficiency'):
+        R_efficiency = efficiency_reward(requested, mir)
+    with timed('reward.over_allocation'):
+        P_over = over_allocation_penalty(allocated, capacity, beta)
+    with timed('reward.abuse'):
+        abuse_counters = update_abuse_counters(abuse_counters, requested, mir, theta)
+        P_abusive = abusive_usage_penalty(
+            abuse_score_increments(abuse_counters, min_duration), requested.shape[-1], num_intervals, gamma
+        )
+
+    # Total reward
+    R_t = R_efficiency - P_over - P_abusive
+
+    return R_efficiency, P_over, P_abusive, R_t, abuse_counters
+
+
+def trace_rewards(requested, mir, allocated, present=None, initial_counters=None, num_intervals=None,
+                  capacity=TOTAL_BANDWIDTH, beta=BETA, theta=THETA, gamma=GAMMA, min_duration=MIN_DURATION):
+    """Batch mode: score every step of a [T, num_users] trace at once.
+
+    ``present`` masks (step, user) cells that have no entry; they count as
+    neither requesting, allocated nor abusive. Gives the same per-step values as
+    feeding the trace through ``step_rewards`` one step at a time. Returns
+    ``(R_efficiency, P_over, P_abusive, R_t)`` arrays of length T.
+    """
+    if present is None:
+        present = np.ones(requested.shape, dtype=bool)
+    if num_intervals is None:
+        num_intervals = len(requested)
+
+    with timed('reward.efficiency'):
+        R_efficiency = efficiency_reward(requested, mir, present)
+    with timed('reward.over_allocation'):
+        P_over = over_allocation_penalty(np.where(present, allocated, 0), capacity, beta)
+    with timed('reward.abuse'):
+        abuse_mask = abusive(requested, mir, theta) & present
+        abuse_counters = abuse_counters_over_trace(abuse_mask, initial_counters)
+        P_abusive = abusive_usage_penalty(
+            abuse_score_increments(abuse_counters, min_duration), requested.shape[-1], num_intervals, gamma
+        )
+
+    # Total reward
+    R_t = R_efficiency - P_over - P_abusive
+
+    return R_efficiency, P_over, P_abusive, R_t
+
+
+class AbuseTracker:
+    """Streaming abuse scoring with O(num_users) work per interval.
+
+    Keeps, per user, the length of the current abusive run, the abuse score
+    accumulated so far and the last MIR seen, so live allocation decisions can
+    be scored tick by tick without rescanning history. The state can be saved
+    with ``checkpoint`` and reloaded with ``AbuseTracker.restore``.
+    """
+
+    def __init__(self, num_users, theta=THETA, min_duration=MIN_DURATION):
+        self.theta = theta
+        self.min_duration = min_duration
+        self.num_intervals = 0
+        self.run_lengths = np.zeros(num_users, dtype=np.int32)
+        self.scores = np.zeros(num_users, dtype=np.int64)
+        self.last_mir = np.zeros(num_users, dtype=np.float32)
+
+    @property
+    def num_users(self):
+        return len(self.run_lengths)
+
+    @property
+    def total_score(self):
+        return int(self.scores.sum())
+
+    def update(self, requested, mir, present=None):
+        """Score one interval and return the abuse score it added.
+
+        ``mir`` entries that are NaN fall back to the user's last MIR; users
+        outside ``present`` are treated as not abusive.
+        """
+        mir = np.where(np.isnan(mir), self.last_mir, mir)
+        abuse_mask = abusive(requested, mir, self.theta)
+        if present is not None:
+            abuse_mask &= present
+
+        self.run_lengths = np.where(abuse_mask, self.run_lengths + 1, 0).astype(np.int32)
+        gained = self.run_lengths > self.min_duration
+        self.scores += gained
+        self.last_mir[:] = mir
+        self.num_intervals += 1
+
+        return int(gained.sum())
+
+    def penalty(self, num_intervals=None, gamma=GAMMA):
+        """Abuse penalty for the score so far, normalized over ``num_intervals`` (default: seen so far)."""
+        return abusive_usage_penalty(self.total_score, self.num_users, num_intervals or self.num_intervals, gamma)
+
+    def checkpoint(self, path):
+        """Save the tracker state in ``.npz`` format to ``path``, used as given."""
+        # Through a file object, so np.savez does not append .npz to the path restore() is given
+        with open(path, 'wb') as file:
+            np.savez(file, run_lengths=self.run_lengths, scores=self.scores, last_mir=self.last_mir,
+                     num_intervals=self.num_intervals, theta=self.theta, min_duration=self.min_duration)
+
+    @classmethod
+    def restore(cls, path):
+        """Load a tracker saved with ``checkpoint``."""
+        with np.load(path) as state:
+            tracker = cls(len(state['run_lengths']), float(state['theta']), int(state['min_duration']))
+            tracker.num_intervals = int(state['num_intervals'])
+            tracker.run_lengths[:] = state['run_lengths']
+            tracker.scores[:] = state['scores']
+            tracker.last_mir[:] = state['last_mir']
+        return tracker
@@ -0,0 +1,49 @@
+# shared_matrix.py
+from multiprocessing import shared_memory
+import numpy as np
+
+
+class SharedRequestMatrix:
+    """Request matrix placed in shared memory for worker processes.
+
+    The parent process creates it from the output of ``build_request_matrix``
+    and hands the (small, picklable) object to its workers, which attach to
+    the same buffers instead of receiving their own copy of the dataset.
+    The parent is responsible for calling ``unlink`` once the workers are done.
+    """
+
+    def __init__(self, requests, present, did_index, date_index):
+        self.did_index = did_index
+        self.date_index = date_index
+        self.shape = requests.shape
+
+        self._requests_shm = shared_memory.SharedMemory(create=True, size=max(requests.nbytes, 1))
+        self._present_shm = shared_memory.SharedMemory(create=True, size=max(present.nbytes, 1))
+        self._requests_name = self._requests_shm.name
+        self._present_name = self._present_shm.name
+
+        np.ndarray(self.shape, dtype=np.float32, buffer=self._requests_shm.buf)[:] = requests
+        np.ndarray(self.shape, dtype=bool, buffer=self._present_shm.buf)[:] = present
+
+    def __getstate__(self):
+        # Only the segment names travel to the workers, never the buffers
+        state = self.__dict__.copy()
+        state['_requests_shm'] = None
+        state['_present_shm'] = None
+        return state
+
+    def attach(self):
+        """Return a (requests, present, did_index, date_index) tuple backed by shared memory."""
+        if self._requests_shm is None:
+            self._requests_shm = shared_memory.SharedMemory(name=self._requests_name)
+            self._present_shm = shared_memory.SharedMemory(name=self._present_name)
+
+        requests = np.ndarray(self.shape, dtype=np.float32, buffer=self._requests_shm.buf)
+        present = np.ndarray(self.shape, dtype=bool, buffer=self._present_shm.buf)
+        return requests, present, self.did_index, self.date_index
+
+    def unlink(self):
+        """Release the shared segments; call from the creating process only."""
+        for shm in (self._requests_shm, self._present_shm):
+            shm.close()
+            shm.unlink()
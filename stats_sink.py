@@ -0,0 +1,140 @@
+"""
+Buffered statistics sinks for BandwidthMonitor.
+
+Rows are written in the `DID, Date, BW_REQUESTED` schema that `BandwidthEnv`
+reads, so monitor output can be used for training as is. Both sinks keep their
+file open, buffer rows in memory and write them out in batches, once
+`flush_rows` rows are pending or `flush_interval` seconds have passed since
+the last flush.
+
+- `CsvSink` appends to a single CSV file. A file written with another header,
+  such as the older `DDI, Date, Bandwidth` output, is left untouched and the
+  rows go to the next free `<root>.<n>.csv` next to it.
+- `ParquetSink` writes row groups to Parquet files and starts a new file
+  (`<root>.<n>.parquet`) every `rotate_rows` rows or `rotate_interval` seconds.
+"""
+
+import csv
+import os
+import time
+
+COLUMNS = ['DID', 'Date', 'BW_REQUESTED']
+
+
+def csv_header(csv_file):
+    """Return the header row of ``csv_file``, or None if it does not exist or is empty."""
+    if not os.path.isfile(csv_file) or os.path.getsize(csv_file) == 0:
+        return None
+    with open(csv_file, newline='') as file:
+        return next(csv.reader(file), None)
+
+
+class CsvSink:
+    def __init__(self, csv_file, flush_rows=1000, flush_interval=30.0):
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.last_flush = time.monotonic()
+
+        # Never append to a file with another schema: move on to the next file that has ours or none
+        header = csv_header(csv_file)
+        if header is not None and header != COLUMNS:
+            root, ext = os.path.splitext(csv_file)
+            index = 0
+            while csv_header(f"{root}.{index}{ext}") not in (None, COLUMNS):
+                index += 1
+            print(f"{csv_file} has columns {header}; writing {COLUMNS} rows to {root}.{index}{ext} instead")
+            csv_file = f"{root}.{index}{ext}"
+            header = csv_header(csv_file)
+        self.csv_file = csv_file
+
+        # Write the header for a new file, append to one with the same columns
+        if header == COLUMNS:
+            self.file = open(csv_file, mode='a', newline='')
+            self.writer = csv.writer(self.file)
+        else:
+            self.file = open(csv_file, mode='w', newline='')
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(COLUMNS)
+
+    def write_rows(self, rows):
+        """Buffer ``(DID, Date, BW_REQUESTED)`` rows, flushing when a threshold is reached."""
+        self.buffer.extend(rows)
+        if len(self.buffer) >= self.flush_rows or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self.writer.writerows(self.buffer)
+        self.file.flush()
+        self.buffer = []
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class ParquetSink:
+    def __init__(self, parquet_file, flush_rows=1000, flush_interval=30.0, rotate_rows=1_000_000, rotate_interval=3600.0):
+        import pyarrow as pa
+
+        self.root = os.path.splitext(parquet_file)[0]
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.rotate_rows = rotate_rows
+        self.rotate_interval = rotate_interval
+        self.schema = pa.schema([('DID', pa.int64()), ('Date', pa.string()), ('BW_REQUESTED', pa.float64())])
+
+        self.buffer = []
+        self.last_flush = time.monotonic()
+        self.writer = None
+        self.file_index = 0
+        self.file_rows = 0
+        self.file_opened = None
+
+    @property
+    def current_file(self):
+        return f"{self.root}.{self.file_index}.parquet"
+
+    def write_rows(self, rows):
+        """Buffer ``(DID, Date, BW_REQUESTED)`` rows, flushing when a threshold is reached."""
+        self.buffer.extend(rows)
+        if len(self.buffer) >= self.flush_rows or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.last_flush = time.monotonic()
+        if not self.buffer:
+            return
+
+        # Start the next file once the current one is full or old enough
+        if self.writer is not None and (self.file_rows >= self.rotate_rows
+                                        or self.last_flush - self.file_opened >= self.rotate_interval):
+            self.writer.close()
+            self.writer = None
+            self.file_index += 1
+
+        if self.writer is None:
+            while os.path.exists(self.current_file):
+                self.file_index += 1
+            self.writer = pq.ParquetWriter(self.current_file, self.schema)
+            self.file_rows = 0
+            self.file_opened = self.last_flush
+
+        dids, dates, bandwidths = zip(*self.buffer)
+        self.writer.write_table(pa.table({
+            'DID': [int(did) for did in dids],
+            'Date': list(dates),
+            'BW_REQUESTED': list(bandwidths),
+        }, schema=self.schema))
+        self.file_rows += len(self.buffer)
+        self.buffer = []
+
+    def close(self):
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
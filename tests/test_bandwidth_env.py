@@ -0,0 +1,146 @@
+# test_bandwidth_env.py
+import numpy as np
+import pandas as pd
+from bandwidth_env import BandwidthEnv
+
+
+def make_trace(num_users, num_intervals, seed=0):
+    """DID/Date/BW_REQUESTED frame with one request per user and interval."""
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2024-01-01', periods=num_intervals, freq='5min')
+    return pd.DataFrame({
+        'DID': np.tile(np.arange(num_users) + 1, num_intervals),
+        'Date': np.repeat(dates, num_users),
+        'BW_REQUESTED': rng.uniform(0, 15_000, num_users * num_intervals),
+    })
+
+
+def loop_step(state, abuse_counters, action, theta, delta_t_min, gamma, num_intervals):
+    """The per-user loops BandwidthEnv.step was written with, scored as the reward kernel defines it."""
+    num_users = len(state)
+    rewards, penalties, allocated_bandwidths = [], [], []
+
+    # Phase 1: Allocate initial bandwidth per user
+    for j in range(num_users):
+        requested_bw = state[j, 1]
+        allocated_bw = min(requested_bw, 1000)  # Cap initial allocation to 1000
+        state[j, 2] = allocated_bw
+        allocated_bandwidths.append(allocated_bw)
+
+    remaining_bandwidth = 10_000 - sum(allocated_bandwidths)
+
+    # Phase 2: Allocate additional bandwidth based on actions taken
+    for i in range(num_users):
+        mir = action[i]
+        state[i, 0] = mir  # Update Current MIR
+        requested_bw = state[i, 1]
+        additional_bw = min(requested_bw - state[i, 2], mir - state[i, 2])
+        state[i, 2] += additional_bw
+        allocated_bandwidths[i] += additional_bw
+
+    # Abuse detection: the score grows by one for every run longer than delta_t_min
+    abuse_score = 0
+    for i in range(num_users):
+        if state[i, 1] > state[i, 0] * (1 + theta):
+            abuse_counters[i] += 1
+        else:
+            abuse_counters[i] = 0
+        if abuse_counters[i] > delta_t_min:
+            abuse_score += 1
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rewards.append(min(state[i, 0] / state[i, 1], 1))  # Efficiency reward
+
+    P_abusive = gamma * abuse_score / (num_users * num_intervals)
+    total_allocated = sum(allocated_bandwidths)
+    if total_allocated > 10_000:
+        penalties.append((total_allocated - 10_000) / 10_000 * 3)
+
+    return np.mean(rewards) - sum(penalties) - P_abusive, remaining_bandwidth
+
+
+def test_vectorized_step_matches_loop():
+    num_users, num_intervals = 8, 60
+    env = BandwidthEnv(make_trace(num_users, num_intervals))
+    env.reset(seed=0)
+    state, abuse_counters = env.state.copy(), env.abuse_counters.copy()
+
+    rng = np.random.default_rng(1)
+    for _ in range(50):
+        # Fresh requests every step, some of them zero, and MIRs often short of the request
+        requests = rng.uniform(0, 12_000, num_users) * (rng.random(num_users) > 0.2)
+        env.state[:, 1] = requests
+        state[:, 1] = requests
+        action = rng.uniform(1000, 10_000, num_users).astype(np.float32)
+
+        _, reward, _, _, _ = env.step(action)
+        expected_reward, expected_remaining = loop_step(
+            state, abuse_counters, action, env.theta, env.delta_t_min, env.gamma, num_intervals
+        )
+
+        np.testing.assert_allclose(reward, expected_reward)
+        np.testing.assert_allclose(env.remaining_bandwidth, expected_remaining)
+        np.testing.assert_allclose(env.state, state)
+        np.testing.assert_array_equal(env.abuse_counters, abuse_counters)
+    assert abuse_counters.max() > env.delta_t_min  # The abuse penalty was exercised
+
+
+def slot_trace(rows):
+    """DID/Date/BW_REQUESTED frame from (interval, DID, request) tuples."""
+    intervals, dids, requests = zip(*rows)
+    dates = pd.date_range('2024-01-01', periods=max(intervals) + 1, freq='5min')
+    return pd.DataFrame({'DID': dids, 'Date': dates[list(intervals)], 'BW_REQUESTED': requests})
+
+
+def test_slots_follow_users_across_steps():
+    # DID 1 stops after t0, DID 3 only sends at t1; DIDs 4 and 5 arrive at t2 with one slot free
+    env = BandwidthEnv(slot_trace([
+        (0, 1, 5000), (0, 2, 5000),
+        (1, 2, 5100), (1, 3, 5300),
+        (2, 2, 5200), (2, 4, 5400), (2, 5, 5500),
+        (3, 2, 5300), (3, 4, 5400),
+    ]), max_users=2, idle_intervals=1)
+    obs, _ = env.reset(seed=0)
+    assert env.slots.slot_of == {1: 0, 2: 1}
+    np.testing.assert_array_equal(obs[:, 1], [5000, 5000])
+
+    # DID 1 leaves after one idle interval and DID 3 reuses its slot from a clean state
+    obs, _, _, _, info = env.step(np.full(2, 1000.0))
+    assert env.slots.slot_of == {2: 1, 3: 0}
+    assert info['Date'] == pd.Timestamp('2024-01-01 00:05')
+    np.testing.assert_array_equal(obs[:, 1], [5300, 5100])
+    np.testing.assert_array_equal(obs[0, [0, 2, 3]], [1000, 0, 0])
+    np.testing.assert_array_equal(env.abuse_counters, [0, 1])
+
+    # DID 3 leaves in turn; DID 4 takes the slot and DID 5 is turned away
+    obs, _, _, _, _ = env.step(np.full(2, 1000.0))
+    assert env.slots.slot_of == {2: 1, 4: 0}
+    assert env.slots.rejected == 1
+    np.testing.assert_array_equal(obs[:, 1], [5400, 5200])
+    np.testing.assert_array_equal(env.abuse_counters, [0, 2])
+    np.testing.assert_array_equal(env.active_users, [True, True])
+
+    # DID 4 keeps its slot while it keeps sending
+    obs, _, _, _, _ = env.step(np.full(2, 1000.0))
+    assert env.slots.slot_of == {2: 1, 4: 0}
+    np.testing.assert_array_equal(obs[:, 1], [5400, 5300])
+    np.testing.assert_array_equal(env.abuse_counters, [1, 3])
+
+
+def test_idle_users_keep_their_slot():
+    # DID 1 skips t1 but returns at t2, within idle_intervals=2, so DID 3 finds no free slot
+    env = BandwidthEnv(slot_trace([
+        (0, 1, 100), (0, 2, 200),
+        (1, 2, 210), (1, 3, 300),
+        (2, 1, 120), (2, 2, 220),
+    ]), max_users=2, idle_intervals=2)
+    env.reset(seed=0)
+
+    obs, _, _, _, _ = env.step(np.full(2, 1000.0))
+    assert env.slots.slot_of == {1: 0, 2: 1}
+    assert env.slots.rejected == 1
+    np.testing.assert_array_equal(obs[:, 1], [0, 210])
+
+    obs, _, _, _, _ = env.step(np.full(2, 1000.0))
+    assert env.slots.slot_of == {1: 0, 2: 1}
+    np.testing.assert_array_equal(obs[:, 1], [120, 220])
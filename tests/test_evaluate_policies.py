@@ -0,0 +1,39 @@
+# test_evaluate_policies.py
+import numpy as np
+import pandas as pd
+import pytest
+from bandwidth_env import BandwidthEnv, build_request_matrix
+from evaluate_policies import POLICIES, evaluate_policy
+from shared_matrix import SharedRequestMatrix
+
+
+@pytest.mark.parametrize('name', ['static', 'proportional', 'maxmin'])
+def test_rewards_match_trace_following_env(name):
+    # Sparse trace: about a third of the (user, interval) cells have no request
+    rng = np.random.default_rng(0)
+    num_users, num_intervals = 6, 20
+    dates = pd.date_range('2024-01-01', periods=num_intervals, freq='5min')
+    data = pd.DataFrame({
+        'DID': np.tile(np.arange(num_users) + 1, num_intervals),
+        'Date': np.repeat(dates, num_users),
+        'BW_REQUESTED': rng.uniform(0, 8000, num_users * num_intervals),
+    }).sample(frac=0.65, random_state=0).sort_index()
+    requests, present, did_index, date_index = build_request_matrix(data)
+
+    matrix = SharedRequestMatrix(requests, present, did_index, date_index)
+    try:
+        _, R_t = evaluate_policy(matrix, name, {'static_mir': 2000}, segment=7)
+    finally:
+        matrix.unlink()
+
+    # The harness scores every interval with its own requests. A default BandwidthEnv keeps the
+    # requests loaded at reset, so load each interval's requests first, as a trace-following env does
+    env = BandwidthEnv((requests, present, did_index, date_index))
+    env.reset(seed=0)
+    requested = np.where(present, requests, 0).astype(np.float64)
+    kwargs = {'mir': 2000} if name == 'static' else {}
+    mir = np.clip(POLICIES[name](requested, present, 10_000, **kwargs), 1000, 10_000)
+    for t in range(num_intervals):
+        env.state[:, 1] = requested[t]
+        _, reward, _, _, _ = env.step(mir[t])
+        assert R_t[t] == pytest.approx(reward)
@@ -0,0 +1,26 @@
+# test_rewards.py
+import numpy as np
+import pytest
+from rewards import AbuseTracker
+
+
+@pytest.mark.parametrize('name', ['state', 'state.npz'])
+def test_abuse_tracker_checkpoint_round_trip(tmp_path, name):
+    tracker = AbuseTracker(3, theta=0.2, min_duration=1)
+    rng = np.random.default_rng(0)
+    for _ in range(6):
+        tracker.update(rng.uniform(0, 3000, 3), np.array([1000.0, np.nan, 2000.0]))
+
+    path = str(tmp_path / name)
+    tracker.checkpoint(path)
+    restored = AbuseTracker.restore(path)
+
+    assert (restored.theta, restored.min_duration, restored.num_intervals) == (0.2, 1, 6)
+    np.testing.assert_array_equal(restored.run_lengths, tracker.run_lengths)
+    np.testing.assert_array_equal(restored.scores, tracker.scores)
+    np.testing.assert_array_equal(restored.last_mir, tracker.last_mir)
+
+    # Both continue scoring identically
+    requested, mir = np.array([1500.0, 2500.0, 100.0]), np.array([1000.0, 1000.0, 1000.0])
+    assert restored.update(requested, mir) == tracker.update(requested, mir)
+    np.testing.assert_array_equal(restored.run_lengths, tracker.run_lengths)
@@ -1,56 +1,234 @@
 # train_agent.py
+import argparse
+import contextlib
 import os
+import time
 import pandas as pd
 import numpy as np
 from stable_baselines3 import PPO
-from bandwidth_env import BandwidthEnv  # Import the environment class
+from stable_baselines3.common.callbacks import BaseCallback
+from stable_baselines3.common.vec_env import DummyVecEnv, SubprocVecEnv
+import profiling
+from bandwidth_env import BandwidthEnv, build_request_matrix  # Import the environment class
+from dataset_cache import load_dataset
+from chunked_trace import ChunkedTrace, StreamingBandwidthEnv, scan_trace
+from hierarchical_env import HierarchicalBandwidthEnv
+from vec_env import BatchedBandwidthEnv
+from shared_matrix import SharedRequestMatrix
+from history_recorder import history_frame, load_history, spill_path_for
 
-# Load your initial dataset
-file_path = r"C:\Users\asus\OneDrive\Bureau\DevFest_RL\sorted.csv"
-data = pd.read_csv(file_path)
 
-# Initialize the BandwidthEnv environment
-env = BandwidthEnv(data)
+def parse_args():
+    parser = argparse.ArgumentParser(description="Train a PPO agent on the bandwidth allocation environment.")
+    parser.add_argument('--data', default='sorted.csv', help="CSV dataset with DID, Date and BW_REQUESTED columns")
+    parser.add_argument('--cache-dir', default=None,
+                        help="Directory for the columnar dataset cache (default: .dataset_cache next to --data)")
+    parser.add_argument('--stream', action='store_true',
+                        help="Replay the time-sorted trace from disk in chunks instead of loading it into memory")
+    parser.add_argument('--chunk-intervals', type=int, default=1024,
+                        help="Intervals per chunk read ahead in --stream mode")
+    parser.add_argument('--cell-size', type=int, default=None,
+                        help="Train one policy shared by every user, with users grouped into cells of this size")
+    parser.add_argument('--n-envs', type=int, default=1, help="Number of environment worker processes")
+    parser.add_argument('--batched', type=int, default=None, metavar='N',
+                        help="Step N copies of the environment together in this process as one batched env")
+    parser.add_argument('--total-timesteps', type=int, default=None,
+                        help="Training steps (default: one pass over the trace per environment)")
+    parser.add_argument('--seed', type=int, default=None, help="Random seed")
+    parser.add_argument('--model', default='bandwidth_model', help="Path to save the trained model")
+    parser.add_argument('--output', default=os.path.join('/mnt/data', 'output_observations.csv'),
+                        help="CSV file for the recorded observations")
+    parser.add_argument('--history-size', type=int, default=1000,
+                        help="Number of recent observations each environment keeps in memory")
+    parser.add_argument('--history-path', default=None,
+                        help="Stream the full observation history to this .npy or .parquet file (one per env)")
+    parser.add_argument('--profile', action='store_true',
+                        help="Record per-phase timings of the env and reward kernel and log them after every rollout")
+    parser.add_argument('--profile-dump', default=None,
+                        help="JSON file the phase timing summary is written to every --profile-interval seconds")
+    parser.add_argument('--profile-interval', type=float, default=60, help="Seconds between phase timing dumps")
+    parser.add_argument('--cprofile', default=None, help="Run training under cProfile and save the stats to this file")
+    args = parser.parse_args()
+    if args.cell_size is not None and (args.stream or args.n_envs > 1):
+        parser.error("--cell-size runs every user in one process and cannot be combined with --stream or --n-envs")
+    if args.batched is not None and (args.stream or args.n_envs > 1 or args.cell_size is not None):
+        parser.error("--batched steps every copy in one process and cannot be combined with "
+                     "--stream, --n-envs or --cell-size")
+    return args
 
-# Define and train the PPO agent
-model = PPO("MlpPolicy", env, verbose=1)
-model.learn(total_timesteps=len(env.unique_intervals[0]))  # Adjust total_timesteps as needed
 
-observations = np.array(env.observation_history)
-output_data = []
+def make_env(matrix, history_size, history_path):
+    """Return a factory for a BandwidthEnv worker reading the shared request matrix."""
+    def _init():
+        return BandwidthEnv(matrix.attach(), history_size=history_size, history_path=history_path)
+    return _init
 
-# Loop through all observations to structure the output data correctly
-for step_idx, observation in enumerate(env.observation_history):
-    for user_idx in range(env.num_users):
-        output_data.append({
-            'DID': user_idx + 1,  # User ID starts from 1
-            'Current_MIR': observation[user_idx, 0],  # Current MIR for the user
-            'Requested_Bandwidth': observation[user_idx, 1],  # Bandwidth requested
-            'Allocated_Bandwidth': observation[user_idx, 2],  # Bandwidth allocated
-            'Abuse_Flag': observation[user_idx, 3]  # Abuse flag status
-        })
 
-# Convert to DataFrame for analysis
-output_df = pd.DataFrame(output_data)
+def make_streaming_env(csv_path, chunk_intervals, did_index, num_intervals, history_size, history_path):
+    """Return a factory for a BandwidthEnv worker replaying the trace from disk."""
+    def _init():
+        trace = ChunkedTrace(csv_path, chunk_intervals, did_index=did_index, num_intervals=num_intervals)
+        return StreamingBandwidthEnv(trace, history_size=history_size, history_path=history_path)
+    return _init
 
-# Compute the Average Allocation Ratio while avoiding zero requested bandwidth values
-output_df['Allocation_Ratio'] = np.where(
-    output_df['Requested_Bandwidth'] != 0,
-    output_df['Allocated_Bandwidth'] / output_df['Requested_Bandwidth'],
-    np.nan  # Set as NaN where requested bandwidth is zero
-)
 
-# Calculate the mean allocation ratio, ignoring NaNs
-average_allocation_ratio = output_df['Allocation_Ratio'].mean()
+class ProfilingCallback(BaseCallback):
+    """Log the phase timings of the env and reward kernel to SB3's logger after every rollout.
 
-print("Average Allocation Ratio:", average_allocation_ratio)
+    Timings recorded in SubprocVecEnv workers are collected from each worker
+    and merged with this process's. Totals since the start of training are
+    written to ``dump_path`` every ``dump_interval`` seconds and printed at the end.
+    """
 
-output_directory = '/mnt/data'
-output_csv_path = os.path.join(output_directory, 'output_observations.csv')
+    def __init__(self, dump_path=None, dump_interval=60, verbose=0):
+        super().__init__(verbose)
+        self.dump_path = dump_path
+        self.dump_interval = dump_interval
+        self.totals = {}
+        self.last_dump = time.perf_counter()
 
-# Create the directory if it doesn't exist
-os.makedirs(output_directory, exist_ok=True)
+    def _on_step(self):
+        return True
 
-# Save the output DataFrame to a CSV file
-output_df.to_csv(output_csv_path, index=False)
-print(f"Output saved to {output_csv_path}")
+    def _on_rollout_end(self):
+        snapshots = [profiling.snapshot(clear=True)]
+        if isinstance(self.training_env, SubprocVecEnv):
+            snapshots += self.training_env.env_method('profile_snapshot')
+
+        # Statistics of this rollout only
+        for phase, stats in profiling.summary(profiling.merge(snapshots)).items():
+            for key in ('count', 'mean_ms', 'p50_ms', 'p99_ms'):
+                self.logger.record(f"profile/{phase}/{key}", stats[key])
+
+        for state in snapshots:
+            for phase, phase_state in state.items():
+                self.totals.setdefault(phase, profiling.Histogram()).merge(phase_state)
+        if self.dump_path is not None and time.perf_counter() - self.last_dump >= self.dump_interval:
+            profiling.dump(self.dump_path, self.totals)
+            self.last_dump = time.perf_counter()
+
+    def _on_training_end(self):
+        self._on_rollout_end()  # Include the steps after the last full rollout
+        if self.dump_path is not None:
+            profiling.dump(self.dump_path, self.totals)
+        print(profiling.format_summary(profiling.summary(self.totals)))
+
+
+def export_observations(history, output_csv_path):
+    # One row per (step, user), built column-wise from the recorded history
+    output_df = pd.DataFrame({
+        'DID': history['user'].to_numpy() + 1,  # User ID starts from 1
+        'Current_MIR': history['Current_MIR'].to_numpy(),  # Current MIR for the user
+        'Requested_Bandwidth': history['Requested_Bandwidth'].to_numpy(),  # Bandwidth requested
+        'Allocated_Bandwidth': history['Allocated_Bandwidth'].to_numpy(),  # Bandwidth allocated
+        'Abuse_Flag': history['Abuse_Flag'].to_numpy()  # Abuse flag status
+    })
+
+    # Compute the Average Allocation Ratio while avoiding zero requested bandwidth values
+    with np.errstate(divide='ignore', invalid='ignore'):
+        output_df['Allocation_Ratio'] = np.where(
+            output_df['Requested_Bandwidth'] != 0,
+            output_df['Allocated_Bandwidth'] / output_df['Requested_Bandwidth'],
+            np.nan  # Set as NaN where requested bandwidth is zero
+        )
+
+    # Calculate the mean allocation ratio, ignoring NaNs
+    average_allocation_ratio = output_df['Allocation_Ratio'].mean()
+
+    print("Average Allocation Ratio:", average_allocation_ratio)
+
+    # Create the directory if it doesn't exist
+    os.makedirs(os.path.dirname(output_csv_path) or '.', exist_ok=True)
+
+    # Save the output DataFrame to a CSV file
+    output_df.to_csv(output_csv_path, index=False)
+    print(f"Output saved to {output_csv_path}")
+
+
+def main():
+    args = parse_args()
+
+    # Enable before creating the envs so that worker processes record their phases too
+    if args.profile:
+        profiling.enable()
+
+    # Each environment (or copy of the batched env) spills its own history file
+    num_histories = args.batched or args.n_envs
+    history_paths = [None] * num_histories
+    if args.history_path is not None:
+        history_paths = [spill_path_for(args.history_path, rank) for rank in range(num_histories)]
+
+    matrix = None
+    if args.stream:
+        # Scan the trace once; every worker then streams its own copy from disk
+        did_index, num_intervals = scan_trace(args.data)
+        env_fns = [make_streaming_env(args.data, args.chunk_intervals, did_index, num_intervals,
+                                      args.history_size, history_paths[rank]) for rank in range(args.n_envs)]
+        env = SubprocVecEnv(env_fns) if args.n_envs > 1 else DummyVecEnv(env_fns)
+    else:
+        # Load your initial dataset from its columnar cache and index it once for every worker
+        data = load_dataset(args.data, cache_dir=args.cache_dir).to_frame(['DID', 'Date', 'BW_REQUESTED'])
+        requests, present, did_index, date_index = build_request_matrix(data)
+        num_intervals = len(date_index)
+
+        if args.cell_size is not None:
+            # Every user is a sub-environment of one vectorized env driven by the shared policy
+            env = HierarchicalBandwidthEnv((requests, present, did_index, date_index), cell_size=args.cell_size,
+                                           history_size=args.history_size, history_path=history_paths[0])
+        elif args.batched is not None:
+            # All copies step together in one vectorized call, without worker processes
+            env = BatchedBandwidthEnv((requests, present, did_index, date_index), num_envs=args.batched,
+                                      seed=args.seed, history_size=args.history_size, history_path=args.history_path)
+        elif args.n_envs > 1:
+            # Workers attach to the matrix in shared memory instead of unpickling the dataset
+            matrix = SharedRequestMatrix(requests, present, did_index, date_index)
+            env = SubprocVecEnv([make_env(matrix, args.history_size, history_paths[rank])
+                                 for rank in range(args.n_envs)])
+        else:
+            env = DummyVecEnv([lambda: BandwidthEnv((requests, present, did_index, date_index),
+                                                    history_size=args.history_size, history_path=history_paths[0])])
+
+    total_timesteps = args.total_timesteps or num_intervals * env.num_envs
+
+    # Rollouts are one step per user in the shared-policy mode, so collect fewer steps per rollout
+    ppo_kwargs = {}
+    if args.cell_size is not None:
+        ppo_kwargs['n_steps'] = max(8, 2048 // env.num_envs)
+
+    try:
+        # Define and train the PPO agent
+        model = PPO("MlpPolicy", env, verbose=1, seed=args.seed, **ppo_kwargs)
+
+        callback = ProfilingCallback(args.profile_dump, args.profile_interval) if args.profile else None
+        cprofile = profiling.profiled(args.cprofile) if args.cprofile else contextlib.nullcontext()
+
+        start_time = time.perf_counter()
+        with cprofile:
+            model.learn(total_timesteps=total_timesteps, callback=callback)
+        elapsed = time.perf_counter() - start_time
+
+        print(f"Trained {model.num_timesteps} steps in {elapsed:.2f}s "
+              f"({model.num_timesteps / elapsed:.0f} steps/sec with {env.num_envs} env(s))")
+
+        model.save(args.model)
+        print(f"Model saved to {args.model}")
+
+        if args.history_path is None and args.batched is not None:
+            recent = [history.recent() for history in env.histories]
+        elif args.history_path is None:
+            # The shared-policy env keeps a single history for all of its users
+            recent = env.get_attr('observation_history', indices=[0] if args.cell_size is not None else None)
+    finally:
+        env.close()  # Flushes the spilled histories
+        if matrix is not None:
+            matrix.unlink()
+
+    if args.history_path is None:
+        history = pd.concat([history_frame(observations) for observations in recent], ignore_index=True)
+    else:
+        history = pd.concat([load_history(path) for path in history_paths], ignore_index=True)
+    export_observations(history, args.output)
+
+
+if __name__ == "__main__":
+    main()
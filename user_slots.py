@@ -0,0 +1,70 @@
+# user_slots.py
+import numpy as np
+
+
+class UserSlots:
+    """Map a changing set of DIDs onto a fixed number of observation slots.
+
+    A DID gets a free slot the first interval it appears and keeps it while it
+    keeps sending requests. Once it has been absent for ``idle_intervals``
+    consecutive intervals it leaves and its slot returns to the free list,
+    to be handed to the next new DID. DIDs arriving while every slot is taken
+    are turned away and counted in ``rejected``.
+    """
+
+    def __init__(self, capacity, idle_intervals=1):
+        self.capacity = capacity
+        self.idle_intervals = idle_intervals
+        self.clear()
+
+    def clear(self):
+        """Release every slot."""
+        self.slot_of = {}  # DID -> slot
+        self.dids = [None] * self.capacity  # Slot -> DID
+        self.active = np.zeros(self.capacity, dtype=bool)
+        self.last_seen = np.zeros(self.capacity, dtype=np.int64)
+        self.free = list(range(self.capacity - 1, -1, -1))  # Lowest slot on top
+        self.rejected = 0
+
+    def __len__(self):
+        return len(self.slot_of)
+
+    def get(self, did):
+        """Return the slot of ``did``, or None if it holds none."""
+        return self.slot_of.get(did)
+
+    def release(self, slot):
+        """Return ``slot`` to the free list."""
+        del self.slot_of[self.dids[slot]]
+        self.dids[slot] = None
+        self.active[slot] = False
+        self.free.append(int(slot))
+
+    def update(self, dids, t):
+        """Record the DIDs with a request in interval ``t``.
+
+        Returns the slot of each DID (-1 for those turned away), the slots
+        given to new DIDs and the slots freed by DIDs that left.
+        """
+        slots = np.array([self.slot_of.get(did, -1) for did in dids], dtype=np.int64)
+        self.last_seen[slots[slots >= 0]] = t
+
+        # Users absent for too long leave before newcomers are placed, so their slots can be reused
+        left = np.flatnonzero(self.active & (t - self.last_seen >= self.idle_intervals))
+        for slot in left:
+            self.release(slot)
+
+        joined = []
+        for k in np.flatnonzero(slots < 0):
+            if not self.free:
+                self.rejected += 1
+                continue
+            slot = self.free.pop()
+            self.slot_of[dids[k]] = slot
+            self.dids[slot] = dids[k]
+            self.active[slot] = True
+            self.last_seen[slot] = t
+            slots[k] = slot
+            joined.append(slot)
+
+        return slots, np.array(joined, dtype=np.int64), left
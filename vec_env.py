@@ -0,0 +1,130 @@
+# vec_env.py
+import numpy as np
+import pandas as pd
+from gymnasium import spaces
+from stable_baselines3.common.vec_env import VecEnv
+from bandwidth_env import build_request_matrix, allocation_step
+from history_recorder import HistoryRecorder, spill_path_for
+from profiling import timed
+
+
+class InProcessVecEnv(VecEnv):
+    """Base for VecEnvs that hold all of their sub-environments in one object.
+
+    Attributes and methods belong to that object, so they are shared by every
+    sub-environment: ``get_attr`` and ``env_method`` return the same value for
+    each index. Subclasses implement ``reset``, ``step_wait`` and ``close``.
+    """
+
+    render_mode = None
+    _actions = None
+
+    def step_async(self, actions):
+        self._actions = actions
+
+    def get_attr(self, attr_name, indices=None):
+        return [getattr(self, attr_name) for _ in self._get_indices(indices)]
+
+    def set_attr(self, attr_name, value, indices=None):
+        setattr(self, attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        method = getattr(self, method_name)
+        return [method(*method_args, **method_kwargs) for _ in self._get_indices(indices)]
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False for _ in self._get_indices(indices)]
+
+
+class BatchedBandwidthEnv(InProcessVecEnv):
+    """B independent BandwidthEnv copies held as one [B, num_users, 4] array.
+
+    All copies are stepped together with a single vectorized call, so rollout
+    collection needs no subprocesses. Each copy starts its episodes at a random
+    interval of the dataset and runs until the end of the trace, after which it
+    is reset automatically as SB3 expects from a VecEnv. Every copy records
+    its own bounded history in ``histories``, spilled to ``history_path`` with
+    the copy's index in the file name (see ``spill_path_for``).
+    """
+
+    def __init__(self, data, num_envs=8, theta=0.2, delta_t_min=3, gamma=0.5, fill_policy='zero', seed=None,
+                 history_size=1000, history_path=None):
+        # Index the dataset once; every copy reads from the same matrix
+        if isinstance(data, pd.DataFrame):
+            data = build_request_matrix(data, fill_policy)
+        self.requests, self.present, self.did_index, self.date_index = data
+        self.unique_intervals = [np.array(list(self.date_index))]
+        self.num_intervals = len(self.date_index)
+
+        self.num_users = len(self.did_index)  # Number of unique users
+        self.delta_t_min = delta_t_min  # Minimum time intervals for abuse detection
+        self.gamma = gamma  # Weight for penalty calculation
+        self.theta = theta  # Threshold for abuse detection
+
+        observation_space = spaces.Box(low=0, high=10_000, shape=(self.num_users, 4), dtype=np.float32)
+        action_space = spaces.Box(low=1000, high=10_000, shape=(self.num_users,), dtype=np.float32)
+        super().__init__(num_envs, observation_space, action_space)
+
+        # Batched state, one row block per copy
+        self.np_random = np.random.default_rng(seed)
+        self.current_step = np.zeros(num_envs, dtype=np.int64)
+        self.state = np.zeros((num_envs, self.num_users, 4))  # Columns: [Current MIR, BW_requested, BW_allocated, Abuse Flag]
+        self.abuse_counters = np.zeros((num_envs, self.num_users))
+        self.remaining_bandwidth = np.full(num_envs, 10_000.0)
+
+        # To store a bounded history of every copy for analysis later
+        self.histories = [
+            HistoryRecorder(self.num_users, capacity=history_size,
+                            spill_path=None if history_path is None else spill_path_for(history_path, i))
+            for i in range(num_envs)
+        ]
+
+    def _reset_envs(self, mask):
+        """Reset the copies selected by ``mask`` at random start intervals."""
+        starts = self.np_random.integers(0, self.num_intervals, size=int(mask.sum()))
+        present = self.present[starts]
+
+        self.current_step[mask] = starts
+        self.state[mask] = 0
+        self.state[mask, :, 1] = np.where(present, self.requests[starts], 0)  # Requested BW
+        self.state[mask, :, 0] = np.where(present, 1000, 0)  # Initial Current MIR
+        self.abuse_counters[mask] = 0
+        self.remaining_bandwidth[mask] = 10_000
+
+    def reset(self):
+        """Reset every copy and return the batched observation."""
+        if self._seeds[0] is not None:
+            self.np_random = np.random.default_rng(self._seeds[0])
+        self._reset_seeds()
+
+        self._reset_envs(np.ones(self.num_envs, dtype=bool))
+        return self.state.astype(np.float32)
+
+    def step_wait(self):
+        """Step all copies in one vectorized call, auto-resetting finished ones."""
+        rewards, self.remaining_bandwidth, self.abuse_counters = allocation_step(
+            self.state, self.abuse_counters, self._actions, self.theta, self.delta_t_min,
+            self.gamma, self.num_intervals
+        )
+        with timed('env.step.record'):
+            for history, state in zip(self.histories, self.state):
+                history.record(state)
+        self.current_step += 1
+        dones = self.current_step >= self.num_intervals
+
+        obs = self.state.astype(np.float32)
+        infos = [{} for _ in range(self.num_envs)]
+        if dones.any():
+            # Episodes end on the time limit, so they are truncated rather than terminated
+            for i in np.flatnonzero(dones):
+                infos[i]['terminal_observation'] = obs[i].copy()
+                infos[i]['TimeLimit.truncated'] = True
+            self._reset_envs(dones)
+            obs[dones] = self.state[dones]
+
+        return obs, rewards.astype(np.float32), dones, infos
+
+    def close(self):
+        """Flush the recorded histories to disk."""
+        for history in self.histories:
+            history.close()